@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CachedAnswer:
+    __slots__ = ("embedding", "filters", "chunk_ids", "answer", "show_suggestions", "related_entry_ids", "created")
+
+    def __init__(self, embedding, filters, chunk_ids, answer, show_suggestions, related_entry_ids):
+        self.embedding = embedding
+        self.filters = filters
+        self.chunk_ids = chunk_ids
+        self.answer = answer
+        self.show_suggestions = show_suggestions
+        self.related_entry_ids = related_entry_ids
+        self.created = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """
+    Per-user cache of chat answers, looked up by question similarity.
+
+    A question reuses a cached answer when its embedding is within
+    `threshold` cosine similarity of a cached question with the same date
+    and mood filters, and the user's diary is still at the revision the
+    answer was computed from; a new revision drops the user's answers.
+    Revisions are opaque (diary_chat passes the user's index version with
+    its UserVectors revision). Each user keeps at most max_per_user answers
+    and at most max_users users are kept, both least recently used first
+    out.
+    """
+
+    def __init__(self, threshold: float, max_per_user: int, max_users: int, ttl_seconds: float):
+        self.threshold = threshold
+        self.max_per_user = max_per_user
+        self.max_users = max_users
+        self.ttl = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()  # user_id -> (revision, OrderedDict of key -> CachedAnswer)
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id: int, revision, embedding, filters: dict):
+        """The best cached answer for a similar question, or None"""
+        with self._lock:
+            answers = self._answers(user_id, revision)
+            best_key, best_score = None, self.threshold
+            if answers:
+                now = time.monotonic()
+                for key in [k for k, a in answers.items() if now - a.created > self.ttl]:
+                    del answers[key]
+                candidates = [(k, a) for k, a in answers.items() if a.filters == filters]
+                if candidates:
+                    scores = np.stack([a.embedding for _, a in candidates]) @ embedding
+                    i = int(np.argmax(scores))
+                    if scores[i] >= best_score:
+                        best_key = candidates[i][0]
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            answers.move_to_end(best_key)
+            self._users.move_to_end(user_id)
+            return answers[best_key]
+
+    def store(self, user_id: int, revision, embedding, filters: dict, chunk_ids,
+              answer: str, show_suggestions: bool, related_entry_ids):
+        """Cache an answer computed from the user's vectors at `revision`"""
+        if self.max_per_user <= 0 or self.max_users <= 0:
+            return
+        entry = CachedAnswer(embedding, filters, list(chunk_ids), answer, show_suggestions, list(related_entry_ids))
+        with self._lock:
+            answers = self._answers(user_id, revision)
+            if answers is None:
+                answers = OrderedDict()
+                self._users[user_id] = (revision, answers)
+            self._users.move_to_end(user_id)
+            self._next_key += 1
+            answers[self._next_key] = entry
+            while len(answers) > self.max_per_user:
+                answers.popitem(last=False)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def _answers(self, user_id: int, revision):
+        """The user's answers if they are for this revision; stale ones are dropped"""
+        cached = self._users.get(user_id)
+        if cached is None:
+            return None
+        if cached[0] != revision:
+            del self._users[user_id]
+            return None
+        return cached[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "answers": sum(len(answers) for _, answers in self._users.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,133 @@
+"""
+Bring an existing diary_chunks table up to the current model.
+
+Adds missing columns and indexes (and users.index_version), converts legacy JSON embeddings to the
+binary column and copies each entry's created_at and mood onto its chunks.
+
+Usage:
+    python -m ai.backfill_embeddings [--batch-size 500] [--drop-json]
+
+Safe to re-run: only rows still missing data are touched, and every
+batch is committed on its own so an interrupted run just continues where
+it stopped.
+"""
+import argparse
+import json
+
+from sqlalchemy import inspect, text, select, update, bindparam, Text
+from sqlalchemy.schema import CreateIndex
+
+from db.session import engine, SessionLocal
+from models.user import User  # noqa: F401 - DiaryEntry.owner needs it mapped
+from models.diary import DiaryEntry
+from models.diary_chunk import DiaryChunk
+from ai.vector_store import encode_embedding
+
+
+def migrate_schema():
+    """Add missing columns and indexes, relax NOT NULL on the legacy JSON column"""
+    inspector = inspect(engine)
+    columns = {c["name"]: c for c in inspector.get_columns("diary_chunks")}
+    indexes = {i["name"] for i in inspector.get_indexes("diary_chunks")}
+    text_type = Text().compile(dialect=engine.dialect)
+
+    user_columns = {c["name"] for c in inspector.get_columns("users")}
+
+    with engine.begin() as conn:
+        if "index_version" not in user_columns:
+            conn.execute(text("ALTER TABLE users ADD index_version INTEGER NOT NULL DEFAULT 0"))
+            print("Added column users.index_version")
+
+        for name in ("embedding_vec", "entry_created_at", "mood", "content_hash", "embedding_model"):
+            if name not in columns:
+                column_type = DiaryChunk.__table__.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE diary_chunks ADD {name} {column_type} NULL"))
+                print(f"Added column diary_chunks.{name}")
+
+        for index in DiaryChunk.__table__.indexes:
+            if index.name not in indexes:
+                conn.execute(CreateIndex(index))
+                print(f"Created index {index.name}")
+
+        if not columns["embedding"]["nullable"] and engine.dialect.name == "mssql":
+            conn.execute(text(f"ALTER TABLE diary_chunks ALTER COLUMN embedding {text_type} NULL"))
+            print("Made diary_chunks.embedding nullable")
+
+
+def backfill(batch_size: int = 500, drop_json: bool = False):
+    """Convert JSON rows in id order, one committed batch at a time"""
+    values = {"embedding_vec": bindparam("vec")}
+    if drop_json:
+        values["embedding"] = None
+    stmt = (
+        update(DiaryChunk.__table__)
+        .where(DiaryChunk.__table__.c.id == bindparam("chunk_id"))
+        .values(**values)
+    )
+
+    last_id, converted = 0, 0
+    while True:
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(DiaryChunk.id, DiaryChunk.embedding)
+                .where(DiaryChunk.embedding_vec.is_(None), DiaryChunk.id > last_id)
+                .order_by(DiaryChunk.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            db.execute(stmt, [
+                {"chunk_id": chunk_id, "vec": encode_embedding(json.loads(embedding))}
+                for chunk_id, embedding in rows
+            ])
+            db.commit()
+
+        last_id = rows[-1].id
+        converted += len(rows)
+        print(f"Converted {converted} chunks (last id {last_id})")
+
+    print(f"Done, {converted} chunks converted")
+
+
+def backfill_entry_metadata(batch_size: int = 500):
+    """Copy created_at and mood from diary_entries onto chunks that lack them"""
+    entry = select(DiaryEntry).where(DiaryEntry.id == DiaryChunk.entry_id)
+    stmt = (
+        update(DiaryChunk)
+        .where(DiaryChunk.entry_created_at.is_(None), DiaryChunk.entry_id.in_(bindparam("entry_ids", expanding=True)))
+        .values(
+            entry_created_at=entry.with_only_columns(DiaryEntry.created_at).scalar_subquery(),
+            mood=entry.with_only_columns(DiaryEntry.mood).scalar_subquery()
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    last_entry_id, updated = 0, 0
+    while True:
+        with SessionLocal() as db:
+            entry_ids = db.scalars(
+                select(DiaryChunk.entry_id)
+                .where(DiaryChunk.entry_created_at.is_(None), DiaryChunk.entry_id > last_entry_id)
+                .group_by(DiaryChunk.entry_id)
+                .order_by(DiaryChunk.entry_id)
+                .limit(batch_size)
+            ).all()
+            if not entry_ids:
+                break
+            updated += db.execute(stmt, {"entry_ids": entry_ids}).rowcount
+            db.commit()
+
+        last_entry_id = entry_ids[-1]
+        print(f"Copied entry date and mood onto {updated} chunks (last entry id {last_entry_id})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--drop-json", action="store_true", help="clear the JSON column after converting a row")
+    args = parser.parse_args()
+
+    migrate_schema()
+    backfill(batch_size=args.batch_size, drop_json=args.drop_json)
+    backfill_entry_metadata(batch_size=args.batch_size)
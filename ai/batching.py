@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent encode calls into one batched backend call.
+
+    Callers submit a list of texts and get a Future for their rows. A worker
+    thread takes the first pending request, keeps collecting for up to
+    window_ms or until max_batch texts are queued, runs one encode over
+    everything and hands each caller back its own slice. A request larger
+    than max_batch is encoded on its own rather than split. With several
+    workers, several batches can be encoding at once (for a process pool).
+
+    At most max_pending requests wait in the queue (0 for no limit); further
+    callers wait up to submit_timeout seconds for room, then get a
+    TimeoutError.
+    """
+
+    def __init__(self, encode_fn, window_ms: float, max_batch: int, workers: int = 1, max_pending: int = 0,
+                 submit_timeout: float = 30):
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.submit_timeout = submit_timeout
+        self._queue = queue.Queue(maxsize=max(0, max_pending))
+        self._carry = None  # Request that didn't fit in the previous batch
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()  # One worker gathers a batch at a time
+        self._workers = []
+        self.worker_count = max(1, workers)
+
+        self.batches = 0
+        self.texts = 0
+        self.largest_batch = 0
+        self.batch_sizes = {}  # Histogram: texts per batch -> count
+
+    def submit(self, texts) -> Future:
+        future = Future()
+        texts = list(texts)
+        if not texts:
+            future.set_result(np.empty((0, 0), dtype=np.float32))
+            return future
+        self._ensure_worker()
+        try:
+            self._queue.put((texts, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise TimeoutError("Embedding queue is full") from None
+        return future
+
+    def encode(self, texts) -> np.ndarray:
+        return self.submit(texts).result()
+
+    def _ensure_worker(self):
+        if not self._workers:
+            with self._lock:
+                while len(self._workers) < self.worker_count:
+                    worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    worker.start()
+                    self._workers.append(worker)
+
+    def _next_batch(self):
+        first = self._carry or self._queue.get()
+        self._carry = None
+        batch, size = [first], len(first[0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch, size
+
+    def _run(self):
+        while True:
+            with self._collect_lock:
+                batch, size = self._next_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = self.encode_fn(texts)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+
+            with self._lock:
+                self.batches += 1
+                self.texts += size
+                self.largest_batch = max(self.largest_batch, size)
+                self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize() + (self._carry is not None),
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "max_pending": self._queue.maxsize,
+                "workers": self.worker_count,
+            }
@@ -1,15 +1,25 @@
+import asyncio
 import json
+import re
 import numpy as np
 from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
 from sqlalchemy.orm import Session
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 
+from config import settings
+from db.session import SessionLocal
 from ai.llm import get_llm
-from models.diary_chunk import DiaryChunk
 from models.chat_history import ChatHistory
-
-_embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+from models.diary_chunk import DiaryChunk
+from ai.vector_store import active_model_filter, load_owner_embeddings, load_owner_texts, fetch_chunks, fetch_embeddings
+from ai.retrieval import normalize_rows, search, top_k, reciprocal_rank_fusion
+from ai.lexical import BM25Index
+from ai.lru import LRUCache
+from ai.answer_cache import SemanticAnswerCache, CachedAnswer
+from ai.embeddings import embedding_service
+from ai.quantization import QuantizedMatrix
+from ai.vector_cache import vector_cache, index_version, UserVectors
+from ai import vector_shards
 
 DIARY_CHAT_PROMPT = """You are a personal diary assistant. Your ONLY job is to help the user find and understand their diary entries.
 
@@ -36,10 +46,185 @@ Answer:"""
 
 
 RELEVANCE_THRESHOLD = 0.30  # Increased for better precision
+TOP_K = 8  # Increased for better coverage
+MOOD_BOOST = 0.10  # Added to the similarity of chunks whose mood the question names
+
+
+_MONTHS = {
+    name: number
+    for number, names in enumerate([
+        ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"),
+        ("may",), ("june", "jun"), ("july", "jul"), ("august", "aug"),
+        ("september", "sep", "sept"), ("october", "oct"), ("november", "nov"), ("december", "dec")
+    ], start=1)
+    for name in names
+}
+_MONTH_PATTERN = "|".join(sorted(_MONTHS, key=len, reverse=True))
+_UNAMBIGUOUS_MONTH_PATTERN = "|".join(sorted(set(_MONTHS) - {"may", "march"}, key=len, reverse=True))
+# "in March", "last march", "during May 2024", "March 2024" - a bare "may"/"march" is too
+# ambiguous, and so is "this may"/"of march" ("this may be why...")
+_MONTH_RE = re.compile(
+    rf"\b(?:(?P<prefix>in|last|during|since)\s+(?P<name>{_MONTH_PATTERN})\b(?:\s+(?P<year>\d{{4}}))?"
+    rf"|(?P<prefix2>this|of)\s+(?P<name2>{_UNAMBIGUOUS_MONTH_PATTERN})\b(?:\s+(?P<year2>\d{{4}}))?"
+    rf"|(?P<name3>{_MONTH_PATTERN})\s+(?P<year3>\d{{4}}))\b"
+)
+# "last 3 days", "past two weeks" and, counting one, "past year"
+_LAST_N_RE = re.compile(
+    r"\b(?:(?:last|past)\s+(\d+|a|one|two|three|four|five|six)|past)\s+(day|week|month|year)s?\b"
+)
+_NUMBER_WORDS = {"a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6}
+
+# Question words -> stored mood values
+MOOD_KEYWORDS = {
+    "happy": "happy", "happiest": "happy", "happiness": "happy", "joy": "happy", "joyful": "happy", "glad": "happy",
+    "sad": "sad", "saddest": "sad", "unhappy": "sad", "upset": "sad",
+    "angry": "angry", "mad": "angry", "frustrated": "angry", "annoyed": "angry",
+    "anxious": "anxious", "worried": "anxious", "nervous": "anxious", "stressed": "anxious", "stress": "anxious",
+    "excited": "excited", "exciting": "excited",
+    "calm": "calm", "relaxed": "calm", "peaceful": "calm",
+}
+
+
+def _month_start(year: int, month: int) -> datetime:
+    return datetime(year + (month - 1) // 12, (month - 1) % 12 + 1, 1)
+
+
+def _parse_query_filters(question: str, now: datetime = None) -> dict:
+    """
+    Pull a date range and mood keywords out of a chat question.
+    
+    Understands today/yesterday, this/last weekend|week|month|year,
+    "last N days", "past year" and month names ("last March", "in May
+    2024", "since March").
+    
+    Returns:
+        dict with 'start' and 'end' (naive UTC, end exclusive; both None
+        when no date was found) and 'moods' (list of mood values)
+    """
+    now = now or datetime.utcnow()
+    today = datetime(now.year, now.month, now.day)
+    text = question.lower()
+    start = end = None
+    monday = today - timedelta(days=today.weekday())
+    
+    def says(phrase):
+        return re.search(rf"\b{phrase}\b", text) is not None
+    
+    month = _MONTH_RE.search(text)
+    last_n = _LAST_N_RE.search(text)
+    if month:
+        prefix = month.group("prefix") or month.group("prefix2")
+        name = month.group("name") or month.group("name2") or month.group("name3")
+        year = month.group("year") or month.group("year2") or month.group("year3")
+        number = _MONTHS[name]
+        if year:
+            year = int(year)
+        elif prefix == "last":
+            year = now.year if number < now.month else now.year - 1
+        else:
+            year = now.year if number <= now.month else now.year - 1
+        start = _month_start(year, number)
+        # "since March" runs up to today
+        end = today + timedelta(days=1) if prefix == "since" else _month_start(year, number + 1)
+    elif last_n:
+        count = _NUMBER_WORDS.get(last_n.group(1)) or int(last_n.group(1) or 1)
+        days = {"day": 1, "week": 7, "month": 30, "year": 365}[last_n.group(2)]
+        start, end = today - timedelta(days=count * days), today + timedelta(days=1)
+    elif says("yesterday"):
+        start, end = today - timedelta(days=1), today
+    elif says("today") or says("tonight"):
+        start, end = today, today + timedelta(days=1)
+    elif says("this weekend") and today.weekday() >= 5:
+        start, end = monday + timedelta(days=5), today + timedelta(days=1)
+    elif says("this weekend") or says("last weekend"):
+        # Before Saturday "this weekend" can only mean the one just gone
+        start, end = monday - timedelta(days=2), monday
+    elif says("this week"):
+        start, end = monday, today + timedelta(days=1)
+    elif says("last week"):
+        start, end = monday - timedelta(days=7), monday
+    elif says("this month"):
+        start, end = _month_start(now.year, now.month), today + timedelta(days=1)
+    elif says("last month"):
+        start, end = _month_start(now.year, now.month - 1), _month_start(now.year, now.month)
+    elif says("this year"):
+        start, end = datetime(now.year, 1, 1), today + timedelta(days=1)
+    elif says("last year"):
+        start, end = datetime(now.year - 1, 1, 1), datetime(now.year, 1, 1)
+    
+    words = re.findall(r"[a-z]+", text)
+    moods = sorted({MOOD_KEYWORDS[w] for w in words if w in MOOD_KEYWORDS})
+    
+    return {"start": start, "end": end, "moods": moods}
+
+
+def _date_query(db: Session, user_id: int, filters: dict):
+    """The user's chunks, within the question's date range if it has one"""
+    query = db.query(DiaryChunk.id).filter(DiaryChunk.owner_id == user_id, active_model_filter())
+    if filters["start"] is not None:
+        query = query.filter(
+            DiaryChunk.entry_created_at >= filters["start"],
+            DiaryChunk.entry_created_at < filters["end"]
+        )
+    return query
+
+
+def _filtered_chunk_ids(db: Session, user_id: int, filters: dict):
+    """
+    Chunk ids in the question's date range, or None when it names no
+    dates. Runs on the (owner_id, entry_created_at) index.
+    """
+    if filters["start"] is None:
+        return None
+    return [row.id for row in _date_query(db, user_id, filters)]
+
+
+def _mood_chunk_ids(db: Session, user_id: int, filters: dict) -> list:
+    """
+    Chunk ids in the date range whose stored mood the question names.
+    
+    These are ranked up rather than filtered on: most entries keep the
+    default mood, and "was I happy with the new job?" is still about the
+    new job.
+    """
+    if not filters["moods"]:
+        return []
+    return [row.id for row in _date_query(db, user_id, filters).filter(DiaryChunk.mood.in_(filters["moods"]))]
+
+
+_question_embeddings = LRUCache(settings.QUESTION_EMBEDDING_CACHE_SIZE)
+
+
+def _normalize_question(text: str) -> str:
+    """Cache key for a question: case, punctuation and spacing don't matter"""
+    return " ".join(re.findall(r"[\w']+", text.lower()))
 
 
 def _embed(text: str):
-    return _embedding_model.encode(text).tolist()
+    key = _normalize_question(text)
+    embedding = _question_embeddings.get(key)
+    if embedding is None:
+        embedding = embedding_service.encode(text)
+        embedding.flags.writeable = False  # Shared between requests
+        _question_embeddings.put(key, embedding)
+    return embedding
+
+
+_answer_cache = SemanticAnswerCache(
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+    max_per_user=settings.ANSWER_CACHE_PER_USER,
+    max_users=settings.ANSWER_CACHE_MAX_USERS,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS
+)
+
+
+def cache_stats() -> dict:
+    """Sizes and hit rates of the caches chat goes through"""
+    return {
+        "vector_cache": vector_cache.stats(),
+        "question_embeddings": _question_embeddings.stats(),
+        "answers": _answer_cache.stats(),
+    }
 
 
 def _get_chat_history(db: Session, user_id: int, session_id: str, limit: int = 5):
@@ -83,57 +268,196 @@ def _save_message(db: Session, user_id: int, session_id: str, role: str, message
     db.add(chat_entry)
 
 
-def chat_with_diary(db: Session, user_id: int, session_id: str, question: str):
+def _load_user_vectors(db: Session, user_id: int, version: int) -> UserVectors:
     """
-    Main chat function with intelligent suggestion detection
+    Build the normalized embedding matrix for all of a user's chunks.
+
+    version is the user's index version read before loading, so the
+    vectors reflect at least that version.
+    """
+    shard = vector_shards.load(user_id) if vector_shards.enabled() else None
+    if shard is not None and shard[3] >= version:
+        # Shards hold unit-length rows; only the first load hits the database
+        chunk_ids, entry_ids, matrix, version = shard
+    else:
+        chunk_ids, entry_ids, matrix = load_owner_embeddings(db, user_id)
+        matrix = normalize_rows(matrix)
+        if vector_shards.enabled():
+            # No shard yet, or it missed a commit (crash, I/O error, another VECTOR_SHARD_DIR)
+            vector_shards.write_base(user_id, chunk_ids, entry_ids, matrix, version)
+    
+    if settings.VECTOR_QUANTIZATION == "int8":
+        matrix = QuantizedMatrix.quantize(matrix)
+    
+    return UserVectors(
+        matrix=matrix,
+        chunk_ids=chunk_ids,
+        entry_ids=entry_ids,
+        version=version
+    ).with_index()
+
+
+def _lexical_index(db: Session, user_id: int, user_vectors: UserVectors) -> BM25Index:
+    """BM25 index for the user, built from their chunk texts on first use"""
+    if user_vectors.lexical is not None:
+        return user_vectors.lexical
+    lexical = user_vectors.lexical_index(lambda: BM25Index.build(load_owner_texts(db, user_id)))
+    vector_cache.resize(user_id)
+    return lexical
+
+
+def _retrieve(db: Session, user_id: int, user_vectors: UserVectors, question: str, question_embedding, filters: dict = None):
+    """
+    Find up to TOP_K relevant chunks for a question.
+    
+    Dates in the question first narrow the candidates to the matching
+    chunks (see _parse_query_filters); chunks whose mood the question
+    names join the candidates and get MOOD_BOOST added to their
+    similarity for qualifying and ranking. Vector candidates come
+    from brute force or the IVF index. With
+    HYBRID_RETRIEVAL, BM25 matches on the chunk text are fused in with
+    reciprocal rank fusion, and on large diaries with enough lexical hits
+    only those chunks are vector-scored. With int8 vectors the candidates
+    are rescored with their stored float32 vectors. A chunk qualifies if
+    its similarity clears RELEVANCE_THRESHOLD or it is one of the TOP_K
+    best lexical matches on terms rarer than LEXICAL_MIN_IDF (exact names
+    and places).
     
-    Args:
-        db: Database session
-        user_id: Current user ID
-        session_id: Session identifier for grouping conversations
-        question: User's question/message
-        
     Returns:
-        dict with 'answer', 'show_suggestions', and 'related_entry_ids'
+        (chunk_ids, scores) best first, scores being cosine similarities
     """
+    if filters is None:
+        filters = _parse_query_filters(question)
+    filtered_ids = _filtered_chunk_ids(db, user_id, filters)
+    allowed_rows = user_vectors.rows_for(filtered_ids) if filtered_ids is not None else None
+    mood_rows = user_vectors.rows_for(_mood_chunk_ids(db, user_id, filters))
+    
+    if not user_vectors.quantized and not settings.HYBRID_RETRIEVAL and not len(mood_rows):
+        if allowed_rows is None:
+            rows, scores = search(
+                user_vectors, question_embedding, k=TOP_K,
+                threshold=RELEVANCE_THRESHOLD, nprobe=settings.IVF_NPROBE
+            )
+        else:
+            best, scores = top_k(
+                user_vectors.matrix[allowed_rows], question_embedding, k=TOP_K, threshold=RELEVANCE_THRESHOLD
+            )
+            rows = allowed_rows[best]
+        return user_vectors.chunk_ids[rows].tolist(), scores.tolist()
+    
+    pool = max(TOP_K, settings.RESCORE_CANDIDATES) if user_vectors.quantized else TOP_K
+    lexical_rows = rare_rows = np.empty(0, dtype=np.int64)
+    if settings.HYBRID_RETRIEVAL:
+        lexical = _lexical_index(db, user_id, user_vectors)
+        lexical_ids, _ = lexical.search(question, settings.LEXICAL_CANDIDATES)
+        lexical_rows = user_vectors.rows_for(lexical_ids)
+        # Matches on rare terms (names, places) qualify without the vector score
+        rare_ids, _ = lexical.search(question, TOP_K, min_idf=settings.LEXICAL_MIN_IDF)
+        rare_rows = user_vectors.rows_for(rare_ids)
+        if allowed_rows is not None:
+            lexical_rows = lexical_rows[np.isin(lexical_rows, allowed_rows)]
+            rare_rows = rare_rows[np.isin(rare_rows, allowed_rows)]
+    
+    if allowed_rows is not None:
+        # Date/mood filters already narrowed the set: score all of it
+        best, _ = top_k(user_vectors.matrix[allowed_rows], question_embedding, k=pool)
+        vector_rows = allowed_rows[best]
+    elif len(lexical_rows) >= pool and len(user_vectors) >= settings.LEXICAL_PREFILTER_MIN_CHUNKS:
+        # Plenty of lexical hits in a large diary: score only those
+        best, _ = top_k(user_vectors.matrix[lexical_rows], question_embedding, k=pool)
+        vector_rows = lexical_rows[best]
+    else:
+        vector_rows, _ = search(user_vectors, question_embedding, k=pool, nprobe=settings.IVF_NPROBE)
+    if len(mood_rows):
+        best, _ = top_k(user_vectors.matrix[mood_rows], question_embedding, k=pool)
+        mood_rows = mood_rows[best]
+    
+    candidate_rows = np.unique(np.concatenate((vector_rows, lexical_rows[:TOP_K], rare_rows, mood_rows)))
+    query = normalize_rows(question_embedding)
+    if user_vectors.quantized:
+        candidate_ids, exact = fetch_embeddings(db, user_vectors.chunk_ids[candidate_rows].tolist())
+        scores = normalize_rows(exact) @ query
+    else:
+        candidate_ids = user_vectors.chunk_ids[candidate_rows].tolist()
+        scores = user_vectors.matrix[candidate_rows] @ query
+    score_by_id = dict(zip(candidate_ids, scores.tolist()))
+    
+    lexical_ranking = user_vectors.chunk_ids[lexical_rows].tolist()
+    rare_matches = set(user_vectors.chunk_ids[rare_rows].tolist())
+    mood_matches = set(user_vectors.chunk_ids[mood_rows].tolist())
+    boosted = {
+        chunk_id: score + (MOOD_BOOST if chunk_id in mood_matches else 0.0)
+        for chunk_id, score in score_by_id.items()
+    }
+    qualified = [
+        chunk_id for chunk_id in candidate_ids
+        if boosted[chunk_id] >= RELEVANCE_THRESHOLD or chunk_id in rare_matches
+    ]
+    
+    if settings.HYBRID_RETRIEVAL:
+        vector_ranking = sorted(candidate_ids, key=boosted.get, reverse=True)
+        fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking])
+        qualified.sort(key=fused.get, reverse=True)
+    else:
+        qualified.sort(key=boosted.get, reverse=True)
+    
+    best_ids = qualified[:TOP_K]
+    return best_ids, [score_by_id[chunk_id] for chunk_id in best_ids]
+
+
+NO_ENTRIES_ANSWER = "You don't have any diary entries yet. Start writing to build your personal memory!"
+LLM_ERROR_ANSWER = "I'm having trouble connecting to my AI brain right now. Please try again in a moment!"
+
+
+class PreparedChat(NamedTuple):
+    """What build_chat_prompt found out before any LLM call"""
+    prompt: Optional[str]  # None: nothing indexed yet, or `cached` answers the question
+    top_chunks: list  # (chunk, score) pairs the prompt was built from
+    cached: Optional[CachedAnswer] = None
+    cache_key: Optional[tuple] = None  # (user_id, revision, embedding, filters) to cache the answer under, if any
+
+
+def build_chat_prompt(db: Session, user_id: int, session_id: str, question: str) -> PreparedChat:
+    """Everything before the LLM call: answer cache, retrieval, history and the prompt"""
     # Cleanup old chats periodically (you could also run this as a scheduled job)
     _cleanup_old_chats(db)
     
-    # Get chat history for context
-    chat_history = _get_chat_history(db, user_id, session_id)
-    chat_context = "\n".join(chat_history) if chat_history else "No previous conversation."
+    # Retrieve the user's chunk vectors (cached per process). A write by
+    # any process bumps the index version, so a stale copy is reloaded.
+    version = index_version(db, user_id)
+    user_vectors = vector_cache.get(
+        user_id,
+        lambda: _load_user_vectors(db, user_id, version),
+        current_version=lambda: version
+    )
     
-    # Retrieve all user's diary chunks
-    chunks = db.query(DiaryChunk).filter(
-        DiaryChunk.owner_id == user_id
-    ).all()
+    if not len(user_vectors):
+        return PreparedChat(None, [])
     
-    if not chunks:
-        answer = "You don't have any diary entries yet. Start writing to build your personal memory!"
-        _save_message(db, user_id, session_id, "user", question)
-        _save_message(db, user_id, session_id, "assistant", answer)
-        db.commit()
-        
-        return {
-            "answer": answer,
-            "show_suggestions": False,
-            "related_entry_ids": []
-        }
-    
-    # Embed the question and find relevant chunks
+    # Embed the question. Opening a conversation with a question similar
+    # to an earlier one can reuse its answer while the diary (index
+    # version) and this process's vectors (revision) are unchanged; later
+    # turns depend on the conversation, so they always go to the LLM.
     question_embedding = _embed(question)
-    vectors = np.array([json.loads(c.embedding) for c in chunks])
-    scores = cosine_similarity([question_embedding], vectors)[0]
+    filters = _parse_query_filters(question)
+    chat_history = _get_chat_history(db, user_id, session_id)
+    cache_key = None
+    if not chat_history:
+        cache_key = (user_id, (version, user_vectors.revision), question_embedding, filters)
+        cached = _answer_cache.lookup(*cache_key)
+        if cached is not None:
+            return PreparedChat(None, [], cached)
     
-    # Filter by relevance threshold and rank
-    relevant_chunks_with_scores = [
-        (chunk, score) for chunk, score in zip(chunks, scores)
-        if score >= RELEVANCE_THRESHOLD
-    ]
+    # Find relevant chunks
+    top_chunk_ids, top_scores = _retrieve(db, user_id, user_vectors, question, question_embedding, filters)
     
-    # Sort by score and take top 8 (increased for better coverage)
-    relevant_chunks_with_scores.sort(key=lambda x: x[1], reverse=True)
-    top_chunks = relevant_chunks_with_scores[:8]
+    # Load the text of the winning chunks only
+    chunks_by_id = fetch_chunks(db, top_chunk_ids)
+    top_chunks = [
+        (chunks_by_id[chunk_id], score)
+        for chunk_id, score in zip(top_chunk_ids, top_scores)
+        if chunk_id in chunks_by_id
+    ]
     
     # Prepare context from relevant chunks
     if top_chunks:
@@ -144,45 +468,21 @@ def chat_with_diary(db: Session, user_id: int, session_id: str, question: str):
     else:
         context = "No relevant diary entries found."
     
-    # Call LLM with full context (with retry logic)
-    llm = get_llm()
+    # Chat history for context
+    chat_context = "\n".join(chat_history) if chat_history else "No previous conversation."
+    
     prompt = DIARY_CHAT_PROMPT.format(
         chat_history=chat_context,
         context=context,
         question=question
     )
-    
-    # Retry up to 3 times if HuggingFace API fails
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = llm.invoke(prompt)
-            full_response = response.content.strip()
-            break
-        except Exception as e:
-            if attempt == max_retries - 1:
-                # Last attempt failed, return friendly error
-                answer = "I'm having trouble connecting to my AI brain right now. Please try again in a moment!"
-                _save_message(db, user_id, session_id, "user", question)
-                _save_message(db, user_id, session_id, "assistant", answer)
-                db.commit()
-                
-                return {
-                    "answer": answer,
-                    "show_suggestions": False,
-                    "related_entry_ids": []
-                }
-            # Wait a bit before retrying
-            import time
-            time.sleep(1)
-    
-    # Parse the response to extract answer and suggestion decision
-    answer, show_suggestions = _parse_llm_response(full_response)
-    
-    # Get entry IDs for suggestions
-    related_entry_ids = []
-    if show_suggestions and top_chunks:
-        related_entry_ids = list({chunk.entry_id for chunk, _ in top_chunks})
+    return PreparedChat(prompt, top_chunks, cache_key=cache_key)
+
+
+def save_chat_reply(db: Session, user_id: int, session_id: str, question: str,
+                    answer: str, show_suggestions: bool = False, related_entry_ids=()):
+    """Record the exchange and build the chat response"""
+    related_entry_ids = list(related_entry_ids)
     
     # Save conversation to database
     _save_message(db, user_id, session_id, "user", question)
@@ -196,30 +496,176 @@ def chat_with_diary(db: Session, user_id: int, session_id: str, question: str):
     }
 
 
-def _parse_llm_response(response: str):
-    """Parse LLM response to extract answer and suggestion decision"""
-    lines = response.split("\n")
-    
-    # Look for the SHOW_SUGGESTIONS line
-    show_suggestions = False
-    answer_lines = []
-    
-    for line in lines:
-        line_upper = line.strip().upper()
-        if "SHOW_SUGGESTIONS:" in line_upper:
-            # Extract YES/NO
-            if "YES" in line_upper:
-                show_suggestions = True
-            elif "NO" in line_upper:
-                show_suggestions = False
-        else:
-            # This is part of the answer
-            answer_lines.append(line)
+def reply_without_llm(db: Session, user_id: int, session_id: str, question: str, prepared: PreparedChat):
+    """Answer a PreparedChat that has no prompt: from the answer cache, or there are no entries"""
+    if prepared.cached is not None:
+        cached = prepared.cached
+        return save_chat_reply(db, user_id, session_id, question,
+                               cached.answer, cached.show_suggestions, cached.related_entry_ids)
+    return save_chat_reply(db, user_id, session_id, question, NO_ENTRIES_ANSWER)
+
+
+def _remember_answer(prepared: PreparedChat, answer: str, show_suggestions: bool) -> list:
+    """Entry ids to suggest for an LLM answer, which is also added to the answer cache if cacheable"""
+    # Get entry IDs for suggestions
+    related_entry_ids = []
+    if show_suggestions and prepared.top_chunks:
+        related_entry_ids = list({chunk.entry_id for chunk, _ in prepared.top_chunks})
+    
+    if prepared.cache_key is not None:
+        _answer_cache.store(
+            *prepared.cache_key,
+            chunk_ids=[chunk.id for chunk, _ in prepared.top_chunks],
+            answer=answer,
+            show_suggestions=show_suggestions,
+            related_entry_ids=related_entry_ids
+        )
+    return related_entry_ids
+
+
+def chat_with_diary(db: Session, user_id: int, session_id: str, question: str):
+    """
+    Main chat function with intelligent suggestion detection
     
-    # Join answer lines and clean up
-    answer = "\n".join(answer_lines).strip()
+    Args:
+        db: Database session
+        user_id: Current user ID
+        session_id: Session identifier for grouping conversations
+        question: User's question/message
+        
+    Returns:
+        dict with 'answer', 'show_suggestions', and 'related_entry_ids'
+    """
+    prepared = build_chat_prompt(db, user_id, session_id, question)
+    if prepared.prompt is None:
+        return reply_without_llm(db, user_id, session_id, question, prepared)
+    
+    # Call LLM with full context (retries, deadline and circuit breaker in ai/resilience.py)
+    try:
+        full_response = get_llm().invoke(prepared.prompt, deadline=settings.LLM_CHAT_DEADLINE).content.strip()
+    except Exception:
+        return save_chat_reply(db, user_id, session_id, question, LLM_ERROR_ANSWER)
+    
+    # Parse the response to extract answer and suggestion decision
+    answer, show_suggestions = _parse_llm_response(full_response)
+    related_entry_ids = _remember_answer(prepared, answer, show_suggestions)
+    return save_chat_reply(db, user_id, session_id, question, answer, show_suggestions, related_entry_ids)
+
+
+async def stream_chat_reply(prepared: PreparedChat, user_id: int, session_id: str, question: str):
+    """
+    Stream the LLM answer for a prompt from build_chat_prompt.
+
+    Yields ("token", text) as the answer arrives, with the SHOW_SUGGESTIONS
+    trailer held back, then ("done", response dict) once the exchange is
+    saved, or ("error", response dict) if the LLM fails. History is written
+    with a session of its own, since the request's session is closed by
+    the time the stream ends.
+    """
+    parser = SuggestionTrailerParser()
+    try:
+        async for delta in get_llm().astream(prepared.prompt, deadline=settings.LLM_CHAT_DEADLINE):
+            text = parser.feed(delta)
+            if text:
+                yield "token", text
+        text, show_suggestions = parser.finish()
+        if text:
+            yield "token", text
+        answer, event = parser.answer.strip(), "done"
+        related_entry_ids = _remember_answer(prepared, answer, show_suggestions)
+    except Exception:
+        answer, show_suggestions, related_entry_ids, event = LLM_ERROR_ANSWER, False, [], "error"
     
-    # Remove any trailing delimiter artifacts
-    answer = answer.replace("SHOW_SUGGESTIONS:", "").strip()
+    def save():
+        with SessionLocal() as db:
+            return save_chat_reply(db, user_id, session_id, question, answer, show_suggestions, related_entry_ids)
     
-    return answer, show_suggestions
\ No newline at end of file
+    yield event, await asyncio.to_thread(save)
+
+
+class SuggestionTrailerParser:
+    """
+    Splits an answer from its SHOW_SUGGESTIONS: trailer as it streams in
+    (_parse_llm_response runs whole completions through it too).
+
+    feed() returns the answer text that is safe to show so far; text that
+    could be the start of a SHOW_SUGGESTIONS: marker is held back until it
+    is clearly not one. The marker line itself is never returned.
+    """
+    MARKER = "SHOW_SUGGESTIONS:"
+
+    def __init__(self):
+        self.answer = ""
+        self.show_suggestions = False
+        self._pending = ""
+        self._marker_line = None  # Text after the marker, until the line ends
+
+    def feed(self, delta: str) -> str:
+        self._pending += delta
+        out = []
+        while self._pending:
+            if self._marker_line is not None:
+                newline = self._pending.find("\n")
+                if newline < 0:
+                    self._marker_line += self._pending
+                    self._pending = ""
+                    break
+                self._marker_line += self._pending[:newline]
+                self._pending = self._pending[newline + 1:]
+                self._end_marker()
+                continue
+            
+            index = self._pending.upper().find(self.MARKER)
+            if index >= 0:
+                out.append(self._pending[:index])
+                self._pending = self._pending[index + len(self.MARKER):]
+                self._marker_line = ""
+                continue
+            
+            # Keep a tail that might still grow into the marker
+            upper = self._pending.upper()
+            keep = next(
+                (n for n in range(min(len(upper), len(self.MARKER) - 1), 0, -1) if self.MARKER.startswith(upper[-n:])),
+                0
+            )
+            out.append(self._pending[:len(self._pending) - keep])
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        
+        text = "".join(out)
+        self.answer += text
+        return text
+
+    def finish(self):
+        """Flush what is left once the stream ends; returns (text, show_suggestions)"""
+        text = ""
+        if self._marker_line is not None:
+            self._end_marker()
+        else:
+            text = self._pending
+            self.answer += text
+        self._pending = ""
+        return text, self.show_suggestions
+
+    def _end_marker(self):
+        line = self._marker_line.upper()
+        if "YES" in line:
+            self.show_suggestions = True
+        elif "NO" in line:
+            self.show_suggestions = False
+        self._marker_line = None
+
+
+def _parse_llm_response(response: str):
+    """
+    Parse LLM response to extract answer and suggestion decision.
+
+    Goes through SuggestionTrailerParser so /chat and /chat/stream store
+    the same answer for the same completion: text before a
+    SHOW_SUGGESTIONS: marker on its line is kept, the marker and the rest
+    of its line are dropped.
+    """
+    parser = SuggestionTrailerParser()
+    parser.feed(response)
+    _, show_suggestions = parser.finish()
+    return parser.answer.strip(), show_suggestions
\ No newline at end of file
@@ -1,11 +1,15 @@
-import json
-from sentence_transformers import SentenceTransformer
+import hashlib
+
+import numpy as np
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
 
+from config import settings
 from models.diary_chunk import DiaryChunk
-
-# Load once
-_embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+from ai.vector_store import EMBEDDING_DIM, encode_embedding, fetch_embeddings
+from ai.vector_cache import replace_entry_on_commit, touch_on_commit
+from ai.embedding_cache import embedding_cache
+from ai.embeddings import model_id
 
 
 def _chunk_text(text: str, max_chars: int = 500):
@@ -28,24 +32,105 @@ def _chunk_text(text: str, max_chars: int = 500):
     return chunks
 
 
-def _embed(text: str):
-    return _embedding_model.encode(text).tolist()
+def _embed(db: Session, texts):
+    # One batched encode per entry for texts not already in the embedding
+    # cache; stored unit-length so retrieval is a plain dot product
+    return embedding_cache.encode(db, texts)
+
+
+def _chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
 def index_diary_entry(db: Session, entry, user_id: int):
-    # Delete old chunks (safe for create + update)
-    db.query(DiaryChunk).filter(
-        DiaryChunk.entry_id == entry.id
-    ).delete()
+    """
+    Bring the entry's chunks in line with its content.
 
+    Chunks whose text is unchanged keep their rows and embeddings (only
+    chunk_index moves if needed); only new or edited chunks, and chunks
+    embedded by another model, are embedded and inserted. Chunks that
+    disappeared are deleted.
+    """
     chunks = _chunk_text(entry.content)
+    hashes = [_chunk_hash(chunk) for chunk in chunks]
+    current_model = model_id()
+
+    # Existing rows by hash; rows from before content_hash hash their text
+    existing, stale = {}, []
+    for row in db.query(
+        DiaryChunk.id, DiaryChunk.chunk_index, DiaryChunk.content_hash, DiaryChunk.chunk_text,
+        DiaryChunk.mood, DiaryChunk.embedding_model
+    ).filter(
+        DiaryChunk.entry_id == entry.id
+    ).order_by(DiaryChunk.chunk_index):
+        if (row.embedding_model or settings.LEGACY_EMBEDDING_MODEL) != current_model:
+            stale.append(row.id)
+        else:
+            existing.setdefault(row.content_hash or _chunk_hash(row.chunk_text), []).append(row)
 
-    for i, chunk in enumerate(chunks):
-        embedding = _embed(chunk)
-        db.add(DiaryChunk(
-            entry_id=entry.id,
-            owner_id=user_id,
-            chunk_text=chunk,
-            embedding=json.dumps(embedding),
-            chunk_index=i
-        ))
+    chunk_ids = [None] * len(chunks)
+    moved, added = [], []
+    for i, chunk_hash in enumerate(hashes):
+        rows = existing.get(chunk_hash)
+        if rows:
+            row = rows.pop(0)
+            chunk_ids[i] = row.id
+            if row.chunk_index != i or row.content_hash is None or row.mood != entry.mood:
+                moved.append({"id": row.id, "chunk_index": i, "content_hash": chunk_hash, "mood": entry.mood})
+        else:
+            added.append(i)
+    removed = stale + [row.id for rows in existing.values() for row in rows]
+
+    if removed:
+        db.query(DiaryChunk).filter(
+            DiaryChunk.id.in_(removed)
+        ).delete(synchronize_session=False)
+    if moved:
+        db.execute(update(DiaryChunk), moved)
+    if not added and not removed:
+        return
+
+    embeddings = _embed(db, [chunks[i] for i in added]) if added else []
+    if added:
+        # One multi-row INSERT ... OUTPUT instead of a round trip per chunk;
+        # ids come back in chunk order
+        result = db.execute(
+            insert(DiaryChunk).returning(DiaryChunk.id, sort_by_parameter_order=True),
+            [
+                {
+                    "entry_id": entry.id,
+                    "owner_id": user_id,
+                    "chunk_text": chunks[i],
+                    "embedding_vec": encode_embedding(embedding),
+                    "chunk_index": i,
+                    "content_hash": hashes[i],
+                    "embedding_model": current_model,
+                    "entry_created_at": entry.created_at,
+                    "mood": entry.mood,
+                }
+                for i, embedding in zip(added, embeddings)
+            ]
+        )
+        for i, chunk_id in zip(added, result.scalars()):
+            chunk_ids[i] = chunk_id
+
+    # The cache swaps the entry's rows wholesale, so it needs the kept
+    # chunks' vectors too
+    matrix = np.zeros((len(chunks), EMBEDDING_DIM), dtype=np.float32)
+    kept = sorted(set(range(len(chunks))) - set(added))
+    if kept:
+        _, matrix[kept] = fetch_embeddings(db, [chunk_ids[i] for i in kept])
+    if added:
+        matrix[added] = embeddings
+
+    # Patch the cached vectors (and IVF lists) in place once the
+    # transaction commits
+    replace_entry_on_commit(db, user_id, entry.id, chunk_ids, matrix, chunks)
+
+
+def sync_chunk_mood(db: Session, entry):
+    """Copy a changed mood onto the entry's chunks without re-embedding"""
+    db.query(DiaryChunk).filter(
+        DiaryChunk.entry_id == entry.id
+    ).update({"mood": entry.mood}, synchronize_session=False)
+    touch_on_commit(db, entry.owner_id)
@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.embedding_cache import CachedEmbedding
+from ai.embeddings import embedding_service, model_id
+from ai.lru import LRUCache
+from ai.vector_store import EMBEDDING_DIM, encode_embedding, decode_embedding
+
+logger = logging.getLogger(__name__)
+
+_LOOKUP_BATCH = 500  # Hashes per IN (...) query
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC with whitespace runs collapsed; this is also what gets embedded"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embeddings keyed by (model id, sha256 of normalized text).
+
+    Looks in a per-process LRU first, then in the embedding_cache table, and
+    only encodes what neither has. New embeddings are written to the table
+    inside a savepoint of the caller's transaction, so a concurrent writer
+    of the same text only costs the cache rows, not the caller's work.
+    """
+
+    def __init__(self, max_items: int, persist: bool = True, service=embedding_service):
+        self.memory = LRUCache(max_items)
+        self.service = service
+        self.persist = persist
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.encoded = 0
+        self._lock = threading.Lock()
+
+    def encode(self, db: Session, texts) -> np.ndarray:
+        """Unit-length float32 embeddings, one row per text"""
+        current_model = model_id()
+        normalized = [normalize_text(t) for t in texts]
+        hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in normalized]
+
+        found = {}
+        for h in set(hashes):
+            vector = self.memory.get((current_model, h))
+            if vector is not None:
+                found[h] = vector
+        memory_hits = len(found)
+
+        missing = [h for h in dict.fromkeys(hashes) if h not in found]
+        if missing and self.persist and db is not None:
+            for h, vector in self._load(db, current_model, missing).items():
+                found[h] = vector
+                self.memory.put((current_model, h), vector)
+        table_hits = len(found) - memory_hits
+
+        # Each distinct text is encoded once, even if repeated in this call
+        to_encode = {h: t for h, t in zip(hashes, normalized) if h not in found}
+        if to_encode:
+            vectors = self.service.encode_batch(list(to_encode.values()))
+            new = dict(zip(to_encode, vectors))
+            for h, vector in new.items():
+                vector.flags.writeable = False  # Shared through the LRU
+                found[h] = vector
+                self.memory.put((current_model, h), vector)
+            if self.persist and db is not None:
+                self._store(db, current_model, new)
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.table_hits += table_hits
+            self.encoded += len(to_encode)
+
+        if not hashes:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        return np.stack([found[h] for h in hashes])
+
+    def _load(self, db: Session, current_model: str, hashes) -> dict:
+        found = {}
+        for start in range(0, len(hashes), _LOOKUP_BATCH):
+            rows = db.execute(
+                select(CachedEmbedding.text_hash, CachedEmbedding.embedding_vec).where(
+                    CachedEmbedding.model_id == current_model,
+                    CachedEmbedding.text_hash.in_(hashes[start:start + _LOOKUP_BATCH])
+                )
+            )
+            for h, blob in rows:
+                found[h] = decode_embedding(blob)
+        return found
+
+    def _store(self, db: Session, current_model: str, vectors: dict):
+        try:
+            with db.begin_nested():
+                db.execute(insert(CachedEmbedding), [
+                    {"model_id": current_model, "text_hash": h, "embedding_vec": encode_embedding(vector)}
+                    for h, vector in vectors.items()
+                ])
+        except IntegrityError:
+            # Another worker cached some of these texts first
+            logger.debug("Embedding cache insert raced with another writer")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.table_hits + self.encoded
+            return {
+                "memory": self.memory.stats(),
+                "memory_hits": self.memory_hits,
+                "table_hits": self.table_hits,
+                "encoded": self.encoded,
+                "hit_rate": (self.memory_hits + self.table_hits) / lookups if lookups else 0.0,
+            }
+
+
+embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE, persist=settings.EMBEDDING_CACHE_PERSIST)
@@ -0,0 +1,248 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from config import settings
+from ai.batching import MicroBatcher
+
+
+class SentenceTransformerBackend:
+    """Reference backend: the PyTorch sentence-transformers model"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts) -> np.ndarray:
+        return self.model.encode(list(texts), normalize_embeddings=True)
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime backend for a model exported with `python -m ai.export_onnx`.
+
+    Needs only onnxruntime and tokenizers (no torch). Reproduces the
+    sentence-transformers pipeline: tokenize, run the transformer, mean-pool
+    over the attention mask, L2-normalize. tokenizer.json must sit next to
+    the .onnx file.
+    """
+
+    def __init__(self, model_path: str, threads: int = 0, max_length: int = 256):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(model_path), "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def encode(self, texts) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+def load_backend(name: str = None, threads: int = None):
+    """
+    Build the embedding backend selected by EMBEDDING_BACKEND, behind a
+    process pool when EMBEDDING_POOL_SIZE is set. An explicit name always
+    builds an in-process backend (that is what each pool worker loads).
+    """
+    if name is None and settings.EMBEDDING_POOL_SIZE > 0:
+        return ProcessPoolBackend(
+            settings.EMBEDDING_BACKEND,
+            settings.EMBEDDING_POOL_SIZE,
+            max_pending=settings.EMBEDDING_POOL_MAX_PENDING,
+            threads=settings.EMBEDDING_POOL_THREADS,
+        )
+    name = name or settings.EMBEDDING_BACKEND
+    if name == "sentence-transformers":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformerBackend(settings.EMBEDDING_MODEL)
+    if name == "onnx":
+        return OnnxBackend(settings.ONNX_MODEL_PATH, threads=threads or settings.ONNX_THREADS)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {name!r}")
+
+
+def model_id() -> str:
+    """
+    Identifies the vector space stored embeddings live in. Backends of the
+    same model share it (the ONNX export is verified against the reference
+    model), so switching EMBEDDING_BACKEND keeps existing chunks usable;
+    set EMBEDDING_SPACE to re-embed without renaming the model.
+    """
+    return settings.EMBEDDING_SPACE or settings.EMBEDDING_MODEL
+
+
+# The model loaded in each pool worker process
+_worker_backend = None
+
+
+def _init_worker(name: str, threads: int):
+    global _worker_backend
+    _worker_backend = load_backend(name, threads=threads)
+
+
+def _worker_encode(texts) -> np.ndarray:
+    return np.asarray(_worker_backend.encode(texts), dtype=np.float32)
+
+
+class ProcessPoolBackend:
+    """
+    Runs a backend in worker processes so inference doesn't compete with
+    request handling for the GIL. Each worker loads the model once at
+    start. Large requests are split across the workers. At most
+    max_pending encodes are in flight; further callers wait up to
+    submit_timeout seconds for a slot, then get a TimeoutError.
+    """
+
+    min_split = 32  # Smallest slice worth sending to another worker
+
+    concurrent = True  # Safe to call from several threads at once
+
+    def __init__(self, name: str, size: int, max_pending: int, threads: int = 1, submit_timeout: float = 30):
+        self.name = name
+        self.size = size
+        self.threads = threads
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(max(size, max_pending))
+        self._lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self):
+        # spawn, not fork: the API process has threads (and maybe a loaded model)
+        return ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.name, self.threads),
+        )
+
+    def encode(self, texts) -> np.ndarray:
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            raise TimeoutError("Embedding pool queue is full")
+        try:
+            executor = self._executor
+            if executor is None:
+                raise RuntimeError("Embedding pool is shut down")
+            texts = list(texts)
+            if not texts:
+                return np.empty((0, 0), dtype=np.float32)
+            step = max(self.min_split, -(-len(texts) // self.size))
+            try:
+                futures = [executor.submit(_worker_encode, texts[i:i + step]) for i in range(0, len(texts), step)]
+                return np.concatenate([future.result() for future in futures])
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM); restart the pool for later calls
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = self._start()
+                raise
+        finally:
+            self._slots.release()
+
+    def warmup(self):
+        """Start every worker and load its model"""
+        futures = [self._executor.submit(_worker_encode, ["warmup"]) for _ in range(self.size)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class EmbeddingService:
+    """
+    Process-wide sentence embedder shared by indexing and chat.
+
+    The backend (and torch or onnxruntime) is only loaded on first use, so
+    workers that never touch AI endpoints don't pay for it. With
+    EMBEDDING_BATCH_WINDOW_MS set, concurrent calls are coalesced by a
+    MicroBatcher. An in-process backend is called by one thread at a time,
+    since it already spreads a single encode across cores; a process pool
+    gets one batch in flight per worker. Either way at most
+    EMBEDDING_POOL_MAX_PENDING requests queue up behind them.
+    """
+
+    def __init__(self, backend_loader=load_backend, batch_window_ms: float = None, max_batch: int = None):
+        self._backend_loader = backend_loader
+        self._backend = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+        window = settings.EMBEDDING_BATCH_WINDOW_MS if batch_window_ms is None else batch_window_ms
+        max_batch = settings.EMBEDDING_MAX_BATCH if max_batch is None else max_batch
+        workers = max(1, settings.EMBEDDING_POOL_SIZE)
+        self.batcher = MicroBatcher(
+            self._encode_direct, window, max_batch, workers=workers, max_pending=settings.EMBEDDING_POOL_MAX_PENDING
+        ) if window > 0 else None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._load_lock:
+                if self._backend is None:
+                    self._backend = self._backend_loader()
+        return self._backend
+
+    def encode(self, text: str) -> np.ndarray:
+        """Unit-length float32 embedding of one text"""
+        return self.encode_batch([text])[0]
+
+    def encode_batch(self, texts) -> np.ndarray:
+        """Unit-length float32 embeddings, one row per text"""
+        if self.batcher is not None:
+            return self.batcher.encode(texts)
+        return self._encode_direct(texts)
+
+    def _encode_direct(self, texts) -> np.ndarray:
+        backend = self.backend
+        if getattr(backend, "concurrent", False):
+            return np.asarray(backend.encode(texts), dtype=np.float32)
+        with self._encode_lock:
+            return np.asarray(backend.encode(texts), dtype=np.float32)
+
+    def warmup(self):
+        """Load the backend and run one encode so the first request doesn't"""
+        if hasattr(self.backend, "warmup"):
+            self.backend.warmup()
+        else:
+            self.encode("warmup")
+
+    def shutdown(self):
+        """Stop pool workers, if any; the backend is reloaded on next use"""
+        with self._load_lock:
+            backend, self._backend = self._backend, None
+        if backend is not None and hasattr(backend, "shutdown"):
+            backend.shutdown()
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self._backend).__name__ if self._backend is not None else None,
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+        }
+
+
+embedding_service = EmbeddingService()
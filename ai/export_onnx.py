@@ -0,0 +1,95 @@
+"""
+Export the sentence embedding model to ONNX for the onnx backend.
+
+Usage:
+    python -m ai.export_onnx [--output onnx/all-MiniLM-L6-v2] [--no-quantize]
+
+Writes model.onnx, model_int8.onnx (dynamic int8 quantization, unless
+--no-quantize) and tokenizer.json, then checks that every exported
+model's embeddings match the sentence-transformers ones to within
+--tolerance (minimum cosine similarity). Exits non-zero if not, so the
+check can gate a deploy. Needs torch, transformers, sentence-transformers,
+onnx and onnxruntime; the API workers then only need onnxruntime and
+tokenizers.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from config import settings
+from ai.embeddings import OnnxBackend, SentenceTransformerBackend
+
+SAMPLE_TEXTS = [
+    "Today I went for a long walk by the river and felt calm for the first time in weeks.",
+    "Work was stressful. The deadline moved up again and nobody told me.",
+    "hi",
+    "Dinner with Anna in Paris, we laughed about the time the train broke down in Lyon.",
+    "I keep thinking about whether I should move back home next year.",
+    "Gratitude list: coffee, sunshine, my sister's phone call, finishing the book.",
+    " ".join(["A very long entry that goes on and on about the same thing."] * 60),
+]
+
+
+def export(model_name: str, output_dir: str) -> str:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(f"sentence-transformers/{model_name}")
+    model = AutoModel.from_pretrained(f"sentence-transformers/{model_name}").eval()
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                name: {0: "batch", 1: "sequence"}
+                for name in ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")
+            },
+            opset_version=17,
+            dynamo=False,
+        )
+    return path
+
+
+def quantize(model_path: str) -> str:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path = os.path.join(os.path.dirname(model_path), "model_int8.onnx")
+    quantize_dynamic(model_path, path, weight_type=QuantType.QInt8)
+    return path
+
+
+def verify(model_name: str, model_paths, tolerance: float) -> bool:
+    """Compare each ONNX model with sentence-transformers on SAMPLE_TEXTS"""
+    reference = SentenceTransformerBackend(model_name).encode(SAMPLE_TEXTS)
+    ok = True
+    for path in model_paths:
+        similarity = np.sum(OnnxBackend(path).encode(SAMPLE_TEXTS) * reference, axis=1)
+        passed = similarity.min() >= tolerance
+        ok = ok and passed
+        print(f"{os.path.basename(path)}: min cosine {similarity.min():.5f}, mean {similarity.mean():.5f} "
+              f"({'ok' if passed else f'below {tolerance}'})")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL)
+    parser.add_argument("--output", default=os.path.join("onnx", settings.EMBEDDING_MODEL))
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.99)
+    args = parser.parse_args()
+
+    paths = [export(args.model, args.output)]
+    if not args.no_quantize:
+        paths.append(quantize(paths[0]))
+    sys.exit(0 if verify(args.model, paths, args.tolerance) else 1)
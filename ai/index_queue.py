@@ -0,0 +1,205 @@
+"""
+Durable background indexing of diary entries.
+
+Diary writes call schedule_index, which (with INDEX_ASYNC) only records an
+IndexJob in the same transaction as the entry, so the request returns
+without waiting for embedding. Workers claim jobs with a compare-and-set
+UPDATE, reindex the entry and mark the job done in one transaction, so
+chat keeps seeing the previous chunks until the new ones are committed.
+
+Workers run either as a thread inside each API process
+(INDEX_WORKER_IN_PROCESS) or on their own:
+
+    python -m ai.index_queue [--once]
+
+API processes notice an external worker's changes through the user's
+index version, see ai/vector_cache.py.
+"""
+import argparse
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from db.session import SessionLocal
+from models.user import User  # noqa: F401 - DiaryEntry.owner needs it mapped
+from models.diary import DiaryEntry
+from models.index_job import IndexJob
+from ai.diary_indexing import index_diary_entry
+
+logger = logging.getLogger(__name__)
+
+# Set after a commit that enqueued work, so a local worker doesn't wait out its poll interval
+_wake = threading.Event()
+
+
+def enqueue_index(db: Session, entry):
+    """Queue entry for (re)indexing once db commits, merging with any queued job"""
+    now = datetime.utcnow()
+    job = db.query(IndexJob).filter(IndexJob.entry_id == entry.id).first()
+    if job is None:
+        db.add(IndexJob(entry_id=entry.id, owner_id=entry.owner_id, status="pending",
+                        version=1, attempts=0, available_at=now))
+    elif job.status == "running" and job.available_at > now:
+        # A worker holds the lease and may be indexing this entry right now.
+        # Another worker must not start on it in parallel, so the job stays
+        # claimed; the version change makes _finish hand it back as pending.
+        job.version = job.version + 1
+    else:
+        job.status = "pending"
+        job.version = job.version + 1
+        job.attempts = 0
+        job.last_error = None
+        job.available_at = now
+    event.listen(db, "after_commit", lambda session: _wake.set(), once=True)
+
+
+def schedule_index(db: Session, entry, user_id: int):
+    """Index entry now, or queue it when INDEX_ASYNC is on"""
+    if settings.INDEX_ASYNC:
+        enqueue_index(db, entry)
+    else:
+        index_diary_entry(db, entry, user_id)
+
+
+def index_status(db: Session, entry_id: int) -> dict:
+    job = db.query(IndexJob).filter(IndexJob.entry_id == entry_id).first()
+    if job is None:
+        # Indexed synchronously, or before the queue existed
+        return {"status": "done", "attempts": 0, "last_error": None, "updated_at": None}
+    return {
+        "status": job.status,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "updated_at": job.updated_at,
+    }
+
+
+def _claim(db: Session):
+    """Lease the oldest runnable job; returns (job id, version) or None"""
+    now = datetime.utcnow()
+    candidates = (
+        db.query(IndexJob.id, IndexJob.version, IndexJob.attempts)
+        .filter(IndexJob.status.in_(("pending", "running")), IndexJob.available_at <= now)
+        .order_by(IndexJob.available_at)
+        .limit(10)
+        .all()
+    )
+    for job_id, version, attempts in candidates:
+        # Expired "running" leases belong to a worker that died mid-job.
+        # Every claim bumps attempts, so only one worker's UPDATE matches.
+        claimed = db.execute(
+            update(IndexJob)
+            .where(IndexJob.id == job_id, IndexJob.version == version, IndexJob.attempts == attempts)
+            .values(status="running", attempts=IndexJob.attempts + 1,
+                    available_at=now + timedelta(seconds=settings.INDEX_JOB_LEASE_SECONDS))
+        ).rowcount
+        db.commit()
+        if claimed:
+            return job_id, version
+    return None
+
+
+def _finish(db: Session, job_id: int, version: int, **values):
+    updated = db.execute(
+        update(IndexJob)
+        .where(IndexJob.id == job_id, IndexJob.version == version)
+        .values(**values)
+    ).rowcount
+    if not updated:
+        # Re-enqueued while we worked: runnable again now that our lease ends
+        db.execute(
+            update(IndexJob)
+            .where(IndexJob.id == job_id, IndexJob.status == "running")
+            .values(status="pending", attempts=0, last_error=None, available_at=datetime.utcnow())
+        )
+
+
+def run_next(db: Session) -> bool:
+    """Process one job; False when there was nothing to do"""
+    claimed = _claim(db)
+    if claimed is None:
+        return False
+    job_id, version = claimed
+
+    job = db.get(IndexJob, job_id)
+    entry = db.get(DiaryEntry, job.entry_id)
+    if entry is None:
+        db.delete(job)
+        db.commit()
+        return True
+
+    try:
+        index_diary_entry(db, entry, entry.owner_id)
+        _finish(db, job_id, version, status="done", last_error=None)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.exception("Indexing entry %s failed", entry.id)
+        job = db.get(IndexJob, job_id)
+        if job is None:  # Entry deleted meanwhile
+            return True
+        attempts = job.attempts
+        if attempts >= settings.INDEX_MAX_ATTEMPTS:
+            _finish(db, job_id, version, status="failed", last_error=str(exc)[:2000])
+        else:
+            retry_at = datetime.utcnow() + timedelta(seconds=2 ** attempts)
+            _finish(db, job_id, version, status="pending", last_error=str(exc)[:2000], available_at=retry_at)
+        db.commit()
+    return True
+
+
+def run_worker(stop: threading.Event, once: bool = False):
+    """Process jobs until stop is set (or the queue is empty, with once)"""
+    while not stop.is_set():
+        _wake.clear()
+        db = SessionLocal()
+        try:
+            worked = run_next(db)
+        except Exception:
+            logger.exception("Index worker error")
+            worked = False
+        finally:
+            db.close()
+        if once and not worked:
+            return
+        if not worked:
+            _wake.wait(settings.INDEX_POLL_SECONDS)
+
+
+class BackgroundIndexer:
+    """In-process index worker thread, started and stopped with the app"""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=run_worker, args=(self._stop,), name="index-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        _wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+background_indexer = BackgroundIndexer()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        run_worker(threading.Event(), once=args.once)
+    except KeyboardInterrupt:
+        pass
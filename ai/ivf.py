@@ -0,0 +1,95 @@
+import numpy as np
+
+from ai.retrieval import normalize_rows
+
+# Rows per block when assigning vectors to centroids, bounds the
+# temporary (rows x n_lists) score matrix
+_ASSIGN_BLOCK = 4096
+
+
+class IVFIndex:
+    """
+    Inverted-file index over unit-length vectors.
+
+    Spherical k-means centroids, each with the list of chunk ids assigned
+    to it. A search scores only the chunks in the nprobe lists whose
+    centroids are closest to the query. Instances are never mutated:
+    add() and remove() return a new index, so concurrent readers always
+    see a consistent one.
+    """
+
+    def __init__(self, centroids: np.ndarray, lists: list, built_size: int):
+        self.centroids = centroids
+        self.lists = lists
+        self.built_size = built_size
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, chunk_ids: np.ndarray, n_lists: int = None, iterations: int = 10, seed: int = 0):
+        """Train centroids on a sample of matrix and assign every row"""
+        n = len(matrix)
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+
+        # np.asarray dequantizes when matrix is a QuantizedMatrix
+        sample = np.asarray(matrix[rng.choice(n, min(n, n_lists * 64), replace=False)], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+
+        for _ in range(iterations):
+            assign = _assign(sample, centroids)
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=n_lists)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            filled = counts > 0
+
+            sums = centroids.copy()  # Empty clusters keep their old centroid
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+            centroids = normalize_rows(sums)
+
+        lists = _group(_assign(matrix, centroids), np.asarray(chunk_ids, dtype=np.int64), n_lists)
+        return cls(centroids, lists, n)
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.lists)
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + sum(ids.nbytes for ids in self.lists)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Chunk ids in the nprobe lists nearest to a unit-length query"""
+        scores = self.centroids @ query
+        nprobe = min(nprobe, len(scores))
+        probe = np.argpartition(scores, -nprobe)[-nprobe:]
+        return np.concatenate([self.lists[i] for i in probe])
+
+    def add(self, chunk_ids, matrix: np.ndarray):
+        """Return a new index with the given rows assigned to their nearest list"""
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        if not len(chunk_ids):
+            return self
+        assign = _assign(matrix, self.centroids)
+        lists = list(self.lists)
+        for list_no in np.unique(assign):
+            lists[list_no] = np.concatenate((lists[list_no], chunk_ids[assign == list_no]))
+        return IVFIndex(self.centroids, lists, self.built_size)
+
+    def remove(self, chunk_ids):
+        """Return a new index without the given chunk ids"""
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        if not len(chunk_ids):
+            return self
+        lists = [ids[~np.isin(ids, chunk_ids)] for ids in self.lists]
+        return IVFIndex(self.centroids, lists, self.built_size)
+
+
+def _assign(matrix, centroids):
+    return np.concatenate([
+        np.argmax(matrix[start:start + _ASSIGN_BLOCK] @ centroids.T, axis=1)
+        for start in range(0, len(matrix), _ASSIGN_BLOCK)
+    ]) if len(matrix) else np.empty(0, dtype=np.intp)
+
+
+def _group(assign, chunk_ids, n_lists):
+    order = np.argsort(assign, kind="stable")
+    bounds = np.cumsum(np.bincount(assign, minlength=n_lists))[:-1]
+    return np.split(chunk_ids[order], bounds)
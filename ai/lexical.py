@@ -0,0 +1,118 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Words too common in diaries to tell chunks apart
+STOPWORDS = frozenset("""
+a about after again all am an and any are as at be because been before being
+but by can could did do does doing for from had has have having he her here
+him his how i i'm if in into is it it's its just me more most my myself no
+not now of off on once only or other our out over own same she so some such
+than that the their them then there these they this those through to too
+under until up very was we were what when where which while who why will
+with would you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over one user's chunk texts.
+
+    Postings map term -> {chunk_id: term frequency} so entries can be
+    replaced incrementally when they are re-indexed or deleted. Writers
+    and readers share a lock; the index is updated in place.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._lengths = {}
+        self._chunk_terms = {}
+        self._entry_chunks = defaultdict(list)
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows):
+        """Index (chunk_id, entry_id, chunk_text) rows"""
+        index = cls()
+        for chunk_id, entry_id, text in rows:
+            index._add(chunk_id, entry_id, text)
+        return index
+
+    def __len__(self):
+        return len(self._lengths)
+
+    @property
+    def nbytes(self) -> int:
+        # Rough CPython footprint: a dict slot and a tuple slot per posting
+        postings = sum(len(terms) for terms in self._chunk_terms.values())
+        return postings * 110 + len(self._postings) * 80 + len(self._lengths) * 150
+
+    def replace_entry(self, entry_id: int, chunk_ids, texts):
+        with self._lock:
+            for chunk_id in self._entry_chunks.pop(entry_id, []):
+                self._remove(chunk_id)
+            for chunk_id, text in zip(chunk_ids, texts):
+                self._add(chunk_id, entry_id, text)
+
+    def search(self, query: str, k: int, min_idf: float = 0.0):
+        """
+        Query terms with an idf below min_idf (too common in this diary to
+        mean much) are ignored.
+
+        Returns:
+            (chunk_ids, scores) arrays of the best k matches, best first
+        """
+        with self._lock:
+            n = len(self._lengths)
+            if not n:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            avg_length = self._total_length / n
+
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                chunks = self._postings.get(term)
+                if not chunks:
+                    continue
+                idf = math.log(1 + (n - len(chunks) + 0.5) / (len(chunks) + 0.5))
+                if idf < min_idf:
+                    continue
+                for chunk_id, tf in chunks.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        chunk_ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+        if k < len(values):
+            best = np.argpartition(values, -k)[-k:]
+            chunk_ids, values = chunk_ids[best], values[best]
+        order = np.argsort(values)[::-1]
+        return chunk_ids[order], values[order]
+
+    def _add(self, chunk_id, entry_id, text):
+        tokens = tokenize(text)
+        for term in tokens:
+            postings = self._postings[term]
+            postings[chunk_id] = postings.get(chunk_id, 0) + 1
+        self._lengths[chunk_id] = len(tokens)
+        self._chunk_terms[chunk_id] = tuple(set(tokens))
+        self._total_length += len(tokens)
+        self._entry_chunks[entry_id].append(chunk_id)
+
+    def _remove(self, chunk_id):
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+        for term in self._chunk_terms.pop(chunk_id, ()):
+            del self._postings[term][chunk_id]
+            if not self._postings[term]:
+                del self._postings[term]
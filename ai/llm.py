@@ -1,17 +1,152 @@
-import os
-from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
-
-load_dotenv()
-
-def get_llm():
-    #LLAMA 3.1 8B (Good alternative)
-    llm = HuggingFaceEndpoint(
-        repo_id="meta-llama/Meta-Llama-3.1-8B-Instruct",
-        task="text-generation",
-        huggingfacehub_api_token=os.getenv("HF_API_TOKEN"),
-        max_new_tokens=400,
-        temperature=0.3,
-        timeout=120
-    )
-    return ChatHuggingFace(llm=llm)
+import json
+import threading
+from typing import NamedTuple
+
+import httpx
+
+from config import settings
+from ai.resilience import CircuitBreaker, ResilientLLM
+
+
+class LLMResponse(NamedTuple):
+    content: str
+
+
+class LLMClient:
+    """
+    Process-wide chat completion client (LLAMA 3.1 8B on the Hugging Face
+    router's OpenAI-compatible API).
+
+    One sync and one async httpx client are created on first use and
+    reused by every call, so chat turns and weekly summaries share pooled
+    keep-alive connections instead of paying for a new client, TLS
+    handshake and connection each time.
+    """
+
+    def __init__(self, base_url: str, model: str, token: str, max_new_tokens: int = 400,
+                 temperature: float = 0.3, timeout: float = 120, connect_timeout: float = 10,
+                 max_connections: int = 20, max_keepalive: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.token = token
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    def _options(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "headers": {"Authorization": f"Bearer {self.token}"} if self.token else {},
+            "timeout": self.timeout,
+            "limits": self.limits,
+        }
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(**self._options())
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        # Only used from the server's event loop, so no lock needed
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self._options())
+        return self._async_client
+
+    def _payload(self, prompt: str) -> dict:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": self.max_new_tokens,
+            "temperature": self.temperature,
+        }
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> LLMResponse:
+        response.raise_for_status()
+        return LLMResponse(response.json()["choices"][0]["message"]["content"])
+
+    def _timeout(self, timeout):
+        """The configured timeouts, with none longer than `timeout` seconds"""
+        if timeout is None:
+            return self.timeout
+        return httpx.Timeout(
+            min(self.timeout.read, timeout),
+            connect=min(self.timeout.connect, timeout),
+            pool=min(self.timeout.pool or timeout, timeout)
+        )
+
+    def invoke(self, prompt: str, timeout: float = None) -> LLMResponse:
+        return self._parse(self.client.post(
+            "/chat/completions", json=self._payload(prompt), timeout=self._timeout(timeout)
+        ))
+
+    async def ainvoke(self, prompt: str, timeout: float = None) -> LLMResponse:
+        return self._parse(await self.async_client.post(
+            "/chat/completions", json=self._payload(prompt), timeout=self._timeout(timeout)
+        ))
+
+    async def astream(self, prompt: str):
+        """Yield the completion's text as it is generated (server-sent events)"""
+        payload = {**self._payload(prompt), "stream": True}
+        async with self.async_client.stream("POST", "/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    async def aclose(self):
+        """Close both connection pools (app shutdown)"""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+        async_client, self._async_client = self._async_client, None
+        if async_client is not None:
+            await async_client.aclose()
+
+
+llm_client = LLMClient(
+    base_url=settings.LLM_BASE_URL,
+    model=settings.LLM_MODEL,
+    token=settings.HF_API_TOKEN,
+    max_new_tokens=settings.LLM_MAX_NEW_TOKENS,
+    temperature=settings.LLM_TEMPERATURE,
+    timeout=settings.LLM_TIMEOUT,
+    connect_timeout=settings.LLM_CONNECT_TIMEOUT,
+    max_connections=settings.LLM_MAX_CONNECTIONS,
+    max_keepalive=settings.LLM_MAX_KEEPALIVE,
+)
+
+
+# What chat and weekly summaries call: retries, deadlines and the circuit breaker
+resilient_llm = ResilientLLM(
+    llm_client,
+    CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_SECONDS),
+    max_attempts=settings.LLM_MAX_ATTEMPTS,
+    backoff_base=settings.LLM_BACKOFF_BASE,
+    backoff_max=settings.LLM_BACKOFF_MAX,
+    deadline=settings.LLM_CHAT_DEADLINE,
+    hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+    hedge_min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+    hedge_workers=settings.LLM_MAX_CONNECTIONS,
+)
+
+
+def get_llm() -> ResilientLLM:
+    """The shared client; kept as a function for existing callers"""
+    return resilient_llm
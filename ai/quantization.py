@@ -0,0 +1,65 @@
+import numpy as np
+
+# Rows dequantized per block when scoring, keeps the float32 scratch
+# buffer small (8192 x 384 x 4 bytes = 12 MB)
+_SCORE_BLOCK = 8192
+
+
+class QuantizedMatrix:
+    """
+    int8 scalar-quantized rows with one float32 scale per row.
+
+    Each row is stored as round(x / scale) with scale = max(|x|) / 127, a
+    quarter of the float32 size (plus 4 bytes per row). It supports the
+    parts of the ndarray interface retrieval uses: len(), row indexing and
+    `@` against float vectors or matrices, so it can stand in for the
+    float matrix in UserVectors, top_k and the IVF index. Scores are
+    approximate; callers rescore the best candidates with the exact
+    vectors (see _retrieve in ai/diary_chat.py).
+    """
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, matrix: np.ndarray):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.empty(0, dtype=np.float32)
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return cls(np.ascontiguousarray(codes), scales)
+
+    @classmethod
+    def concatenate(cls, parts):
+        return cls(
+            np.concatenate([p.codes for p in parts]),
+            np.concatenate([p.scales for p in parts])
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return QuantizedMatrix(self.codes[rows], self.scales[rows])
+
+    def __matmul__(self, other):
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        for start in range(0, len(self), _SCORE_BLOCK):
+            block = slice(start, start + _SCORE_BLOCK)
+            scales = self.scales[block] if other.ndim == 1 else self.scales[block, None]
+            out[block] = (self.codes[block].astype(np.float32) @ other) * scales
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self.codes.astype(np.float32) * self.scales[:, None]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
@@ -0,0 +1,130 @@
+"""
+Gradually re-embed chunks produced by an older embedding model.
+
+Usage:
+    python -m ai.reembed [--chunks-per-sec 20] [--batch-entries 20] [--once]
+
+After EMBEDDING_MODEL or EMBEDDING_SPACE changes, chat only scores
+chunks of the new model (see vector_store.active_model_filter), so a
+user's older entries are invisible to it until upgraded. This worker
+upgrades the most recently active users first, entry by entry through
+index_diary_entry (which re-embeds only chunks of other models and keeps
+shards and caches in step), and caps the embedding rate so it can run
+beside production traffic. Without --once it keeps polling for stale
+chunks, e.g. ones written by API workers still on the old model during a
+rolling deploy.
+"""
+import argparse
+import time
+
+from sqlalchemy import and_, func, or_
+
+from config import settings
+from db.session import SessionLocal
+from models.user import User  # noqa: F401 - DiaryEntry.owner needs it mapped
+from models.diary import DiaryEntry
+from models.diary_chunk import DiaryChunk
+from models.chat_history import ChatHistory
+from ai.diary_indexing import index_diary_entry
+from ai.embeddings import model_id
+
+
+def _stale_filter():
+    """Chunks embedded by any model other than the active one"""
+    active = model_id()
+    if active == settings.LEGACY_EMBEDDING_MODEL:
+        return and_(DiaryChunk.embedding_model.isnot(None), DiaryChunk.embedding_model != active)
+    return or_(DiaryChunk.embedding_model.is_(None), DiaryChunk.embedding_model != active)
+
+
+def prioritized_owners(db) -> list:
+    """Owners with stale chunks, most recently active (chatting or writing) first"""
+    stale = dict(
+        db.query(DiaryChunk.owner_id, func.count(DiaryChunk.id))
+        .filter(_stale_filter())
+        .group_by(DiaryChunk.owner_id)
+        .all()
+    )
+    if not stale:
+        return []
+
+    last_active = {}
+    for user_id, at in (
+        db.query(ChatHistory.user_id, func.max(ChatHistory.created_at))
+        .filter(ChatHistory.user_id.in_(stale))
+        .group_by(ChatHistory.user_id)
+    ):
+        last_active[user_id] = at
+    for owner_id, at in (
+        db.query(DiaryEntry.owner_id, func.max(DiaryEntry.updated_at))
+        .filter(DiaryEntry.owner_id.in_(stale))
+        .group_by(DiaryEntry.owner_id)
+    ):
+        if at is not None and (last_active.get(owner_id) is None or at > last_active[owner_id]):
+            last_active[owner_id] = at
+
+    # Never-active owners last, larger backlogs first among equals
+    return sorted(
+        stale,
+        key=lambda owner_id: (last_active.get(owner_id) is not None, last_active.get(owner_id) or 0, stale[owner_id]),
+        reverse=True,
+    )
+
+
+def reembed_owner(owner_id: int, batch_entries: int, chunks_per_sec: float) -> int:
+    """Upgrade all of owner_id's stale entries; returns the chunks replaced"""
+    replaced = 0
+    while True:
+        started = time.monotonic()
+        with SessionLocal() as db:
+            entry_ids = [
+                row.entry_id for row in
+                db.query(DiaryChunk.entry_id)
+                .filter(DiaryChunk.owner_id == owner_id, _stale_filter())
+                .group_by(DiaryChunk.entry_id)
+                .order_by(DiaryChunk.entry_id)
+                .limit(batch_entries)
+            ]
+            if not entry_ids:
+                return replaced
+
+            stale_chunks = db.query(func.count(DiaryChunk.id)).filter(
+                DiaryChunk.entry_id.in_(entry_ids), _stale_filter()
+            ).scalar()
+            for entry in db.query(DiaryEntry).filter(DiaryEntry.id.in_(entry_ids)):
+                index_diary_entry(db, entry, owner_id)
+            db.commit()
+        replaced += stale_chunks
+
+        if chunks_per_sec > 0:
+            wait = stale_chunks / chunks_per_sec - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+
+def run(batch_entries: int, chunks_per_sec: float, once: bool, poll_seconds: float = 60):
+    print(f"Re-embedding stale chunks with {model_id()}")
+    while True:
+        with SessionLocal() as db:
+            owners = prioritized_owners(db)
+        for owner_id in owners:
+            started = time.monotonic()
+            replaced = reembed_owner(owner_id, batch_entries, chunks_per_sec)
+            print(f"User {owner_id}: {replaced} chunks re-embedded in {time.monotonic() - started:.1f}s")
+        if once and not owners:
+            return
+        if not owners:
+            time.sleep(poll_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-entries", type=int, default=20, help="entries per transaction")
+    parser.add_argument("--chunks-per-sec", type=float, default=20, help="0 for no limit")
+    parser.add_argument("--once", action="store_true", help="exit when nothing is stale")
+    args = parser.parse_args()
+
+    try:
+        run(args.batch_entries, args.chunks_per_sec, args.once)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,196 @@
+"""
+Rebuild diary_chunks for every diary entry, e.g. after changing the
+chunking or the embedding model.
+
+Usage:
+    python -m ai.reindex [--batch-size 200] [--workers 4]
+                         [--checkpoint reindex.checkpoint.json] [--restart]
+                         [--max-entries-per-sec 50] [--pause 0.5]
+
+Entries are read in id order, one keyset batch at a time. Each batch's
+chunks are embedded by a pool of --workers processes (texts already in
+the embedding cache are not re-embedded), written with one bulk insert
+and committed together with the deletion of the old chunks, so chat
+always sees either the old or the new chunks of an entry. After every
+committed batch the last entry id goes to the checkpoint file; re-running
+the same command resumes from it.
+
+Vector shards and users' index versions are updated as batches commit,
+so API workers reload the users whose chunks changed.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+
+from config import settings
+from db.session import SessionLocal
+from models.user import User  # noqa: F401 - DiaryEntry.owner needs it mapped
+from models.diary import DiaryEntry
+from models.diary_chunk import DiaryChunk
+from ai.diary_indexing import _chunk_text, _chunk_hash
+from ai.embedding_cache import EmbeddingCache
+from ai.embeddings import EmbeddingService, ProcessPoolBackend, model_id
+from ai.vector_cache import replace_entry_on_commit
+from ai.vector_store import encode_embedding
+
+
+def read_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"last_entry_id": 0, "entries": 0, "chunks": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(path: str, state: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def reindex_batch(db, entries, cache: EmbeddingCache) -> int:
+    """
+    Replace the chunks of entries in one transaction; returns the chunk count.
+
+    Entries edited while the batch was being embedded are left alone: the
+    edit queued its own index job, and writing chunks of the content read
+    earlier would undo it.
+    """
+    chunked = [(entry, _chunk_text(entry.content)) for entry in entries]
+    texts = [chunk for _, chunks in chunked for chunk in chunks]
+    embeddings = cache.encode(db, texts) if texts else []
+
+    # Lock the entries so no edit commits between this check and our commit
+    current = {
+        row.id: row for row in db.execute(
+            select(DiaryEntry.id, DiaryEntry.content, DiaryEntry.mood)
+            .where(DiaryEntry.id.in_([entry.id for entry in entries]))
+            .with_for_update()
+            .with_hint(DiaryEntry, "WITH (UPDLOCK, ROWLOCK)", dialect_name="mssql")
+        )
+    }
+    unchanged, start = [], 0
+    for entry, chunks in chunked:
+        row = current.get(entry.id)
+        if row is not None and row.content == entry.content:
+            unchanged.append((entry, chunks, row.mood, embeddings[start:start + len(chunks)]))
+        start += len(chunks)
+    skipped = len(entries) - len(unchanged)
+    if skipped:
+        print(f"Skipped {skipped} entries edited during the batch")
+
+    db.execute(delete(DiaryChunk).where(DiaryChunk.entry_id.in_([entry.id for entry, *_ in unchanged])))
+
+    current_model = model_id()
+    rows = []
+    for entry, chunks, mood, vectors in unchanged:
+        for i, chunk in enumerate(chunks):
+            rows.append({
+                "entry_id": entry.id,
+                "owner_id": entry.owner_id,
+                "chunk_text": chunk,
+                "embedding_vec": encode_embedding(vectors[i]),
+                "chunk_index": i,
+                "content_hash": _chunk_hash(chunk),
+                "embedding_model": current_model,
+                "entry_created_at": entry.created_at,
+                "mood": mood,
+            })
+    chunk_ids = list(db.execute(
+        insert(DiaryChunk).returning(DiaryChunk.id, sort_by_parameter_order=True), rows
+    ).scalars()) if rows else []
+
+    # Keep vector shards (and this process's cache) in step once committed;
+    # each owner's index version is bumped once for the whole batch
+    start = 0
+    for entry, chunks, _, vectors in unchanged:
+        replace_entry_on_commit(
+            db, entry.owner_id, entry.id,
+            chunk_ids[start:start + len(chunks)],
+            np.asarray(vectors),
+            chunks
+        )
+        start += len(chunks)
+
+    db.commit()
+    return len(rows)
+
+
+def reindex(batch_size: int, workers: int, checkpoint: str, max_entries_per_sec: float = 0, pause: float = 0):
+    state = read_checkpoint(checkpoint)
+    if state["last_entry_id"]:
+        print(f"Resuming after entry {state['last_entry_id']} "
+              f"({state['entries']} entries, {state['chunks']} chunks done)")
+
+    if workers > 0:
+        service = EmbeddingService(
+            backend_loader=lambda: ProcessPoolBackend(
+                settings.EMBEDDING_BACKEND, workers, max_pending=workers, threads=settings.EMBEDDING_POOL_THREADS
+            ),
+            batch_window_ms=0
+        )
+    else:
+        service = EmbeddingService(batch_window_ms=0)
+    cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE, persist=settings.EMBEDDING_CACHE_PERSIST, service=service)
+
+    started = time.monotonic()
+    entries_done, chunks_done = 0, 0
+    try:
+        while True:
+            batch_started = time.monotonic()
+            with SessionLocal() as db:
+                entries = db.execute(
+                    select(DiaryEntry.id, DiaryEntry.owner_id, DiaryEntry.content, DiaryEntry.created_at, DiaryEntry.mood)
+                    .where(DiaryEntry.id > state["last_entry_id"])
+                    .order_by(DiaryEntry.id)
+                    .limit(batch_size)
+                ).all()
+                if not entries:
+                    break
+                chunks = reindex_batch(db, entries, cache)
+
+            entries_done += len(entries)
+            chunks_done += chunks
+            state = {
+                "last_entry_id": entries[-1].id,
+                "entries": state["entries"] + len(entries),
+                "chunks": state["chunks"] + chunks,
+            }
+            write_checkpoint(checkpoint, state)
+
+            elapsed = time.monotonic() - started
+            print(f"Entries up to {state['last_entry_id']}: {entries_done} entries, {chunks_done} chunks, "
+                  f"{entries_done / elapsed:.1f} entries/s, {chunks_done / elapsed:.1f} chunks/s, "
+                  f"cache hit rate {cache.stats()['hit_rate']:.0%}")
+
+            # Throttle to share the database and CPU with production traffic
+            wait = pause
+            if max_entries_per_sec > 0:
+                wait = max(wait, len(entries) / max_entries_per_sec - (time.monotonic() - batch_started))
+            if wait > 0:
+                time.sleep(wait)
+    finally:
+        service.shutdown()
+
+    elapsed = time.monotonic() - started
+    print(f"Done: {entries_done} entries and {chunks_done} chunks in {elapsed:.1f}s "
+          f"({entries_done / elapsed if elapsed else 0:.1f} entries/s, {chunks_done / elapsed if elapsed else 0:.1f} chunks/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200, help="entries per transaction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="embedding processes; 0 embeds in-process")
+    parser.add_argument("--checkpoint", default="reindex.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first entry")
+    parser.add_argument("--max-entries-per-sec", type=float, default=0, help="0 for no limit")
+    parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    reindex(args.batch_size, args.workers, args.checkpoint, args.max_entries_per_sec, args.pause)
@@ -0,0 +1,382 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+
+class LLMUnavailable(Exception):
+    """The LLM gave no answer: circuit open, deadline passed or retries used up"""
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Timeouts, connection errors, rate limiting and server errors; other 4xx are our own fault"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(exc, (httpx.TransportError, TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after `failure_threshold` consecutive failures. Once
+    `reset_seconds` have passed a single trial call is let through
+    (half-open): its success closes the circuit, its failure opens it again.
+    A threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failure_threshold > 0 and (self.state == "half_open" or self.failures >= self.failure_threshold):
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyWindow:
+    """Latencies of the last `size` successful calls"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float):
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ResilientLLM:
+    """
+    An LLMClient with per-call deadlines, retries with exponential backoff
+    and full jitter, and a circuit breaker shared by every caller in the
+    process, so a degraded provider gets fewer requests and request threads
+    stop waiting on it.
+
+    With hedge_percentile set (e.g. 95), a call still running after that
+    percentile of recent latencies gets a second identical request, and
+    whichever answers first wins. In invoke the loser is not cancelled (a
+    blocking httpx call can't be) but it is bounded by the same deadline;
+    ainvoke cancels it.
+    """
+
+    def __init__(self, client, breaker: CircuitBreaker, max_attempts: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, deadline: float = 60.0, hedge_percentile: float = 0,
+                 hedge_min_samples: int = 20, hedge_workers: int = 8):
+        self.client = client
+        self.breaker = breaker
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_workers = hedge_workers
+        self.latencies = LatencyWindow()
+        self.counters = {"calls": 0, "retries": 0, "failed": 0, "hedges": 0, "hedge_wins": 0}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt: str, deadline: float = None):
+        """Like LLMClient.invoke; raises LLMUnavailable if no answer arrives within the deadline"""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        self._count("calls")
+        last_error = None
+        for attempt in range(self.max_attempts):
+            self._check_breaker(last_error)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                response = self._attempt(prompt, remaining)
+            except Exception as e:
+                if not self._failed(e):
+                    raise
+                last_error = e
+                if not self._sleep_before_retry(attempt, e, deadline_at):
+                    break
+                continue
+            self.breaker.record_success()
+            return response
+        self._count("failed")
+        raise LLMUnavailable("LLM call failed within its deadline") from last_error
+
+    async def ainvoke(self, prompt: str, deadline: float = None):
+        """Like LLMClient.ainvoke, with the same deadline, retries, breaker and hedging as invoke"""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        self._count("calls")
+        last_error = None
+        for attempt in range(self.max_attempts):
+            self._check_breaker(last_error)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                async with asyncio.timeout(remaining):
+                    response = await self._async_attempt(prompt, remaining)
+            except Exception as e:
+                if not self._failed(e):
+                    raise
+                last_error = e
+                if not await self._async_sleep_before_retry(attempt, e, deadline_at):
+                    break
+                continue
+            self.breaker.record_success()
+            return response
+        self._count("failed")
+        raise LLMUnavailable("LLM call failed within its deadline") from last_error
+
+    async def astream(self, prompt: str, deadline: float = None):
+        """
+        Like LLMClient.astream. The deadline covers the wait for the first
+        token and failures before it are retried like invoke; once text has
+        been yielded an error is raised as is, since it can't be taken back.
+        """
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        self._count("calls")
+        last_error = None
+        for attempt in range(self.max_attempts):
+            self._check_breaker(last_error)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            stream = self.client.astream(prompt)
+            started = False
+            try:
+                try:
+                    async with asyncio.timeout(remaining):
+                        first = await anext(stream)
+                except StopAsyncIteration:
+                    self.breaker.record_success()
+                    return
+                started = True
+                yield first
+                async for delta in stream:
+                    yield delta
+            except Exception as e:
+                if not self._failed(e) or started:
+                    raise
+                last_error = e
+                if not await self._async_sleep_before_retry(attempt, e, deadline_at):
+                    break
+                continue
+            finally:
+                await stream.aclose()
+            self.breaker.record_success()
+            return
+        self._count("failed")
+        raise LLMUnavailable("LLM stream failed within its deadline") from last_error
+
+    def _check_breaker(self, last_error):
+        if not self.breaker.allow():
+            self._count("failed")
+            raise LLMUnavailable("LLM circuit breaker is open") from last_error
+
+    def _failed(self, exc: Exception) -> bool:
+        """Record a failed attempt with the breaker; False if it isn't worth retrying"""
+        if not is_retryable(exc):
+            self.breaker.record_success()  # The provider answered; the request itself is bad
+            return False
+        self.breaker.record_failure()
+        return True
+
+    def _backoff(self, attempt: int, exc: Exception) -> float:
+        """Full jitter over the exponential step, but never sooner than a Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if isinstance(exc, httpx.HTTPStatusError):
+            retry_after = exc.response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        return delay
+
+    def _retry_delay(self, attempt: int, exc: Exception, deadline_at: float):
+        """Seconds to wait before the next attempt, or None if there is none to make"""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = self._backoff(attempt, exc)
+        if time.monotonic() + delay >= deadline_at:
+            return None
+        self._count("retries")
+        return delay
+
+    def _sleep_before_retry(self, attempt: int, exc: Exception, deadline_at: float) -> bool:
+        delay = self._retry_delay(attempt, exc, deadline_at)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    async def _async_sleep_before_retry(self, attempt: int, exc: Exception, deadline_at: float) -> bool:
+        delay = self._retry_delay(attempt, exc, deadline_at)
+        if delay is None:
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+    def _attempt(self, prompt: str, remaining: float):
+        hedge_after = self._hedge_after()
+        if hedge_after is None or hedge_after >= remaining:
+            return self._timed(prompt, remaining)
+        return self._hedged(prompt, remaining, hedge_after)
+
+    def _timed(self, prompt: str, timeout: float):
+        started = time.monotonic()
+        response = self.client.invoke(prompt, timeout=timeout)
+        self.latencies.add(time.monotonic() - started)
+        return response
+
+    async def _async_timed(self, prompt: str, timeout: float):
+        started = time.monotonic()
+        response = await self.client.ainvoke(prompt, timeout=timeout)
+        self.latencies.add(time.monotonic() - started)
+        return response
+
+    async def _async_attempt(self, prompt: str, remaining: float):
+        """One attempt, hedged like _hedged; the caller bounds it by the deadline"""
+        deadline_at = time.monotonic() + remaining
+        hedge_after = self._hedge_after()
+        if hedge_after is None or hedge_after >= remaining:
+            return await self._async_timed(prompt, remaining)
+
+        primary = asyncio.ensure_future(self._async_timed(prompt, remaining))
+        hedge = None
+        try:
+            done, pending = await asyncio.wait({primary}, timeout=hedge_after)
+            if not done:
+                self._count("hedges")
+                hedge = asyncio.ensure_future(self._async_timed(prompt, max(0.001, deadline_at - time.monotonic())))
+                pending.add(hedge)
+
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Unlike threads, the losing request can be cancelled
+            for task in (primary, hedge):
+                if task is not None:
+                    task.cancel()
+
+    def _hedge_after(self):
+        """Seconds to wait before hedging, or None when hedging is off or has too little data"""
+        if self.hedge_percentile <= 0 or len(self.latencies) < self.hedge_min_samples:
+            return None
+        if self.breaker.state != "closed":
+            return None  # Don't double the load on a struggling provider
+        return self.latencies.percentile(self.hedge_percentile)
+
+    def _hedged(self, prompt: str, remaining: float, hedge_after: float):
+        deadline_at = time.monotonic() + remaining
+        executor = self._pool()
+        primary = executor.submit(self._timed, prompt, remaining)
+        done, pending = wait([primary], timeout=hedge_after)
+        hedge = None
+        if not done:
+            self._count("hedges")
+            hedge = executor.submit(self._timed, prompt, max(0.001, deadline_at - time.monotonic()))
+            pending.add(hedge)
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, timeout=max(0, deadline_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("LLM call passed its deadline")
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.hedge_workers, thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "breaker": self.breaker.stats(),
+            "latency_p50": self.latencies.percentile(50),
+            "latency_p95": self.latencies.percentile(95),
+            "hedge_percentile": self.hedge_percentile,
+        }
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a contiguous float32 copy of matrix with unit-length rows"""
+    matrix = np.array(matrix, dtype=np.float32, order="C")
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int, threshold: float = -1.0):
+    """
+    Score unit-length rows of matrix against a query vector and keep the best k.
+
+    Both sides are expected to be normalized already, so cosine similarity
+    is a single matrix-vector product. The top k are selected with
+    np.argpartition (O(n)) and only those k are sorted.
+
+    Returns:
+        (rows, scores) as arrays ordered by descending score, containing
+        only rows whose score is >= threshold
+    """
+    if k <= 0 or not len(matrix):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+
+    query = normalize_rows(query)
+    scores = matrix @ query
+
+    if k < len(scores):
+        rows = np.argpartition(scores, -k)[-k:]
+    else:
+        rows = np.arange(len(scores))
+
+    rows = rows[scores[rows] >= threshold]
+    rows = rows[np.argsort(scores[rows])[::-1]]
+    return rows, scores[rows]
+
+
+def search(user_vectors, query: np.ndarray, k: int, threshold: float = -1.0, nprobe: int = 8):
+    """
+    top_k over a UserVectors, through its IVF index when it has one.
+
+    With an index only the chunks in the nprobe nearest lists are scored;
+    returned rows still refer to user_vectors.matrix.
+    """
+    if user_vectors.ivf is None:
+        return top_k(user_vectors.matrix, query, k, threshold)
+
+    query = normalize_rows(query)
+    candidate_ids = user_vectors.ivf.candidates(query, nprobe)
+    rows = np.searchsorted(user_vectors.chunk_ids, candidate_ids)
+    candidate_rows, scores = top_k(user_vectors.matrix[rows], query, k, threshold)
+    return rows[candidate_rows], scores
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60) -> dict:
+    """
+    Fuse several best-first rankings of ids into one score per id.
+
+    Each ranking contributes 1 / (k + rank) for every id it contains, so
+    ids ranked well by more than one retriever rise to the top.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return fused
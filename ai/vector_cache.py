@@ -0,0 +1,398 @@
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.user import User
+from ai.ivf import IVFIndex
+from ai.lexical import BM25Index
+from ai.quantization import QuantizedMatrix
+from ai import vector_shards
+from ai.retrieval import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+_revisions = itertools.count(1)
+
+
+class UserVectors:
+    """
+    One user's chunk embeddings, row-aligned with their chunk and entry ids.
+
+    Rows are kept sorted by chunk id so ids can be mapped back to rows with
+    np.searchsorted. Users with at least IVF_MIN_CHUNKS chunks also get an
+    IVF index. The matrix is either float32 or a QuantizedMatrix, in which
+    case scores are approximate. A BM25 index over the chunk texts is built
+    on first hybrid query and then maintained in place. Updates return a
+    new UserVectors instead of mutating this one.
+    """
+
+    def __init__(self, matrix, chunk_ids, entry_ids, ivf: IVFIndex = None, version=None, lexical: BM25Index = None):
+        if not isinstance(matrix, QuantizedMatrix):
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.matrix = matrix
+        self.chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        self.entry_ids = np.asarray(entry_ids, dtype=np.int64)
+        self.ivf = ivf
+        self.version = version  # The user's index version these vectors reflect
+        self.lexical = lexical
+        self.revision = next(_revisions)  # Changes with every load or update, see ai/answer_cache.py
+        self._lexical_lock = threading.Lock()
+
+        if len(self.chunk_ids) > 1 and np.any(np.diff(self.chunk_ids) < 0):
+            order = np.argsort(self.chunk_ids, kind="stable")
+            self.matrix = self.matrix[order]
+            self.chunk_ids = self.chunk_ids[order]
+            self.entry_ids = self.entry_ids[order]
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    @property
+    def quantized(self) -> bool:
+        return isinstance(self.matrix, QuantizedMatrix)
+
+    @property
+    def nbytes(self) -> int:
+        size = self.matrix.nbytes + self.chunk_ids.nbytes + self.entry_ids.nbytes
+        size += self.ivf.nbytes if self.ivf is not None else 0
+        return size + (self.lexical.nbytes if self.lexical is not None else 0)
+
+    def rows_for(self, chunk_ids):
+        """Rows of the given chunk ids, skipping ids these vectors do not have"""
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        rows = np.searchsorted(self.chunk_ids, chunk_ids)
+        found = rows < len(self.chunk_ids)
+        found[found] = self.chunk_ids[rows[found]] == chunk_ids[found]
+        return rows[found]
+
+    def lexical_index(self, loader) -> BM25Index:
+        """The BM25 index over this user's chunk texts, built by loader() on first use"""
+        if self.lexical is None:
+            with self._lexical_lock:
+                if self.lexical is None:
+                    self.lexical = loader()
+        return self.lexical
+
+    def at_version(self, version):
+        """The same vectors under another version (a change they don't reflect, e.g. moods)"""
+        return UserVectors(self.matrix, self.chunk_ids, self.entry_ids, ivf=self.ivf, version=version, lexical=self.lexical)
+
+    def with_index(self):
+        """Build, refresh or drop the IVF index to match the current size"""
+        if len(self) < settings.IVF_MIN_CHUNKS:
+            self.ivf = None
+        elif self.ivf is None or len(self) > 2 * self.ivf.built_size:
+            # Centroids drift as rows are appended, retrain once the size doubles
+            self.ivf = IVFIndex.build(self.matrix, self.chunk_ids)
+        return self
+
+    def replace_entry(self, entry_id: int, chunk_ids, matrix, version=None, texts=None):
+        return self.replace_entries({entry_id: (chunk_ids, matrix, texts)}, version)
+
+    def replace_entries(self, entries: dict, version=None):
+        """
+        Return a copy with the rows of each entry in entries,
+        {entry_id: (chunk_ids, matrix, texts)}, replaced by the given ones.
+
+        texts are the new chunks' texts for the BM25 index; without them
+        the index is dropped and rebuilt on the next hybrid query.
+        """
+        keep = ~np.isin(self.entry_ids, list(entries))
+        dim = self.matrix.shape[1]
+        new_chunk_ids = [np.empty(0, dtype=np.int64)]
+        new_entry_ids = [np.empty(0, dtype=np.int64)]
+        new_rows = [np.empty((0, dim), dtype=np.float32)]
+        for entry_id, (chunk_ids, matrix, _) in entries.items():
+            chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+            new_chunk_ids.append(chunk_ids)
+            new_entry_ids.append(np.full(len(chunk_ids), entry_id, dtype=np.int64))
+            new_rows.append(np.asarray(matrix, dtype=np.float32).reshape(len(chunk_ids), dim))
+        chunk_ids = np.concatenate(new_chunk_ids)
+        matrix = normalize_rows(np.concatenate(new_rows))
+
+        ivf = self.ivf
+        if ivf is not None:
+            ivf = ivf.remove(self.chunk_ids[~keep]).add(chunk_ids, matrix)
+
+        lexical = self.lexical
+        if lexical is not None:
+            if any(texts is None for _, _, texts in entries.values()):
+                lexical = None
+            else:
+                for entry_id, (entry_chunk_ids, _, texts) in entries.items():
+                    lexical.replace_entry(entry_id, np.asarray(entry_chunk_ids, dtype=np.int64).tolist(), texts)
+
+        if self.quantized:
+            matrix = QuantizedMatrix.concatenate((self.matrix[keep], QuantizedMatrix.quantize(matrix)))
+        else:
+            matrix = np.concatenate((self.matrix[keep], matrix))
+
+        return UserVectors(
+            matrix=matrix,
+            chunk_ids=np.concatenate((self.chunk_ids[keep], chunk_ids)),
+            entry_ids=np.concatenate((self.entry_ids[keep], np.concatenate(new_entry_ids))),
+            ivf=ivf,
+            version=version,
+            lexical=lexical
+        ).with_index()
+
+
+class VectorCache:
+    """
+    Process-local LRU cache of UserVectors keyed by owner_id.
+
+    Entries are evicted least-recently-used first once the total size
+    passes max_bytes. Concurrent misses for the same user share a single
+    load, and a load that races with an invalidation is not stored.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._fill_locks = {}
+        self._generations = {}
+
+    def get(self, owner_id: int, loader, current_version=None) -> UserVectors:
+        """
+        Return the cached vectors for owner_id, calling loader() on a miss.
+
+        current_version, if given, is called on a hit; an entry whose
+        version differs (another process changed the user's chunks) is
+        reloaded.
+        """
+        cached = self._fresh(owner_id, current_version)
+        if cached is not None:
+            return cached
+        with self._lock:
+            fill_lock = self._fill_locks.setdefault(owner_id, threading.Lock())
+
+        with fill_lock:
+            cached = self._fresh(owner_id, current_version)
+            if cached is not None:
+                return cached
+            with self._lock:
+                generation = self._generations.get(owner_id, 0)
+
+            try:
+                vectors = loader()
+                with self._lock:
+                    if self._generations.get(owner_id, 0) == generation:
+                        self._store(owner_id, vectors)
+            finally:
+                with self._lock:
+                    self._fill_locks.pop(owner_id, None)
+
+        return vectors
+
+    def invalidate(self, owner_id: int):
+        with self._lock:
+            self._invalidate(owner_id)
+
+    def update(self, owner_id: int, change, expected_version=None):
+        """
+        Apply change(vectors) -> UserVectors to owner_id's cached entry.
+
+        Used by writes instead of invalidate() so the next chat does not pay
+        for a reload. The change runs outside the lock; if another write or
+        invalidation lands meanwhile, or the entry is not at
+        expected_version, the entry is dropped rather than risk losing an
+        update. Any load still in flight is discarded.
+        """
+        with self._lock:
+            generation = self._generations.get(owner_id, 0) + 1
+            self._generations[owner_id] = generation
+            cached = self._entries.get(owner_id)
+        if cached is None:
+            return
+        if cached.version != expected_version:
+            with self._lock:
+                self._discard(owner_id)
+            return
+
+        updated = None
+        try:
+            updated = change(cached)
+        finally:
+            with self._lock:
+                unchanged = (
+                    self._generations.get(owner_id) == generation
+                    and self._entries.get(owner_id) is cached
+                )
+                if unchanged and updated is not None:
+                    self._store(owner_id, updated)
+                else:
+                    self._discard(owner_id)
+
+    def replace_entries(self, owner_id: int, entries: dict, versions=(None, None)):
+        """
+        Swap the rows of entries ({entry_id: (chunk_ids, matrix, texts)})
+        in owner_id's cached vectors, moving them from version before to
+        after.
+        """
+        before, after = versions
+        self.update(
+            owner_id,
+            lambda vectors: vectors.replace_entries(entries, version=after),
+            expected_version=before
+        )
+
+    def resize(self, owner_id: int):
+        """Re-account owner_id's entry after it grew in place (e.g. a lazy BM25 index)"""
+        with self._lock:
+            cached = self._entries.get(owner_id)
+            if cached is not None:
+                self._store(owner_id, cached)
+
+    def clear(self):
+        with self._lock:
+            for owner_id in list(self._entries):
+                self._generations[owner_id] = self._generations.get(owner_id, 0) + 1
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"users": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def _fresh(self, owner_id, current_version):
+        """Cached entry for owner_id, dropping it if its version is stale"""
+        with self._lock:
+            cached = self._lookup(owner_id)
+        if cached is None or current_version is None or cached.version == current_version():
+            return cached
+        with self._lock:
+            if self._entries.get(owner_id) is cached:
+                self._invalidate(owner_id)
+        return None
+
+    def _invalidate(self, owner_id):
+        self._generations[owner_id] = self._generations.get(owner_id, 0) + 1
+        self._discard(owner_id)
+
+    def _lookup(self, owner_id):
+        cached = self._entries.get(owner_id)
+        if cached is not None:
+            self._entries.move_to_end(owner_id)
+        return cached
+
+    def _store(self, owner_id, vectors):
+        self._discard(owner_id)
+        size = vectors.nbytes
+        if size > self.max_bytes:
+            return
+        self._entries[owner_id] = vectors
+        self._sizes[owner_id] = size
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            evicted_id, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(evicted_id)
+
+    def _discard(self, owner_id):
+        if self._entries.pop(owner_id, None) is not None:
+            self._bytes -= self._sizes.pop(owner_id)
+
+
+vector_cache = VectorCache(max_bytes=settings.VECTOR_CACHE_MAX_MB * 1024 * 1024)
+
+
+def index_version(db, owner_id: int) -> int:
+    """
+    owner_id's index version. Every transaction that changes the user's
+    chunks bumps it, so any process can tell its cached vectors are stale
+    with one primary-key lookup.
+    """
+    return db.execute(select(User.index_version).where(User.id == owner_id)).scalar() or 0
+
+
+def bump_index_version(db, owner_id: int):
+    """Increment owner_id's index version in db's transaction; returns (before, after)"""
+    db.execute(
+        update(User)
+        .where(User.id == owner_id)
+        .values(index_version=User.index_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    after = index_version(db, owner_id)
+    return after - 1, after
+
+
+def replace_entry_on_commit(db, owner_id: int, entry_id: int, chunk_ids, matrix, texts):
+    """
+    Once db commits entry_id's new chunks, record them in the user's
+    vector shard (when enabled) and patch the cached vectors
+    """
+    _pending_change(db, owner_id)["entries"][entry_id] = (chunk_ids, matrix, texts)
+
+
+def remove_entry_on_commit(db, owner_id: int, entry_id: int):
+    """Like replace_entry_on_commit, dropping a deleted entry's rows"""
+    replace_entry_on_commit(db, owner_id, entry_id, [], [], [])
+
+
+def touch_on_commit(db, owner_id: int):
+    """Bump owner_id's index version for a chunk change the vectors don't hold (e.g. moods)"""
+    _pending_change(db, owner_id)
+
+
+_PENDING = "vector_cache_pending"
+
+
+def _pending_change(db, owner_id: int) -> dict:
+    """
+    owner_id's changes in db's current transaction. The first one bumps
+    the index version, so a batch touching many of a user's entries costs
+    one update of their row. Kept in db.info rather than as a session
+    listener so a rollback drops them instead of leaving them for the
+    session's next commit.
+    """
+    pending = db.info.setdefault(_PENDING, {})
+    change = pending.get(owner_id)
+    if change is None:
+        change = pending[owner_id] = {"versions": bump_index_version(db, owner_id), "entries": {}}
+    return change
+
+
+def _apply(owner_id: int, change: dict):
+    """
+    Runs inside db.commit() after the data is durable, so errors are logged
+    rather than failing a write that succeeded. The user's shard and cached
+    vectors are dropped instead and rebuilt from the database.
+    """
+    before, after = change["versions"]
+    entries = change["entries"]
+    try:
+        if vector_shards.enabled():
+            vector_shards.append(owner_id, entries, before, after)
+        if entries:
+            vector_cache.replace_entries(owner_id, entries, (before, after))
+        else:
+            vector_cache.update(owner_id, lambda vectors: vectors.at_version(after), expected_version=before)
+    except Exception:
+        logger.exception("Could not apply index version %s for user %s", after, owner_id)
+        vector_cache.invalidate(owner_id)
+        if vector_shards.enabled():
+            vector_shards.invalidate(owner_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session):
+    if session.in_nested_transaction():
+        return  # Only a savepoint was released
+    for owner_id, change in session.info.pop(_PENDING, {}).items():
+        _apply(owner_id, change)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_pending(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_PENDING, None)  # Rolled back or closed without a commit
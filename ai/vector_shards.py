@@ -0,0 +1,359 @@
+"""
+On-disk per-user vector shards, shared by all workers through the page cache.
+
+Each user has these files in a per-format, per-model subdirectory of
+VECTOR_SHARD_DIR (vectors of different embedding models never mix):
+
+    <owner_id>.<n>.vec  base shard generation n: 64-byte header, float32
+                        matrix (count x dim, unit-length rows sorted by
+                        chunk id), int64 chunk ids, int64 entry ids
+    <owner_id>.log      append log: a header naming the current base
+                        generation (0 before the first base) and the
+                        users.index_version the base reflects, then one
+                        record per indexed or deleted entry, "as of
+                        index version n, entry_id's rows are these"
+    <owner_id>.lock     lock file serializing writers across processes
+
+Readers read the log, memory-map the base it names and replay the log over
+it in index version order, without taking the lock. A missing version (an
+append lost to a crash or an I/O error, or made under another
+VECTOR_SHARD_DIR) stops the replay, so the shard reads as older than the
+database and the caller rebuilds it with write_base. Writers always log
+changes, even before the first base exists: a base built later from an
+older database snapshot is brought up to date by the replay. Compaction
+folds the log into base generation n + 1 and then swaps in a fresh log
+naming it; a mapped base is never overwritten (which Windows refuses),
+older generations are deleted once nothing maps them.
+
+Deleting the directory is always safe: shards are rebuilt from the
+database on the next chat. Do so after restoring the database from a
+backup, whose index versions may be behind the shards'.
+"""
+import glob
+import logging
+import os
+import re
+import struct
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import settings
+from ai.embeddings import model_id
+from ai.vector_store import EMBEDDING_DIM, EMBEDDING_DTYPE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"DDVS"
+_FORMAT_VERSION = 3
+_HEADER = struct.Struct("<4sHHIQ")  # magic, format version, reserved, dim, count
+_HEADER_SIZE = 64
+_LOG_MAGIC = b"DDVH"
+_LOG_HEADER = struct.Struct("<4sHHQq")  # magic, format version, reserved, base generation, index version
+_RECORD_MAGIC = b"DDVL"
+_RECORD = struct.Struct("<4sqqqI")  # magic, index version before, after, entry_id, count
+_NO_ENTRY = -1  # Record of a version change the vectors don't hold (e.g. moods)
+_ID_DTYPE = np.dtype("<i8")
+
+
+def enabled() -> bool:
+    return bool(settings.VECTOR_SHARD_DIR)
+
+
+def _dir() -> str:
+    return os.path.join(settings.VECTOR_SHARD_DIR, f"v{_FORMAT_VERSION}", re.sub(r"[^\w.-]", "_", model_id()))
+
+
+def _path(owner_id: int, suffix: str) -> str:
+    return os.path.join(_dir(), f"{owner_id}.{suffix}")
+
+
+def load(owner_id: int):
+    """
+    Read owner_id's shard, replaying the append log over the base.
+
+    The matrix is a read-only np.memmap when the log is empty; otherwise
+    the replayed rows are materialized in memory until the next compaction.
+
+    Returns:
+        (chunk_ids, entry_ids, matrix, index_version), or None without a
+        base shard. Callers holding a newer index version should rebuild
+        the shard with write_base.
+    """
+    generation, base_version, records = _read_log(owner_id)
+    if not generation:
+        return None
+    try:
+        chunk_ids, entry_ids, matrix = _read_base(owner_id, generation)
+    except FileNotFoundError:
+        return None  # Compacted and removed meanwhile; the caller reloads
+
+    index_version, changes = _replay(base_version, records)
+    if changes:
+        chunk_ids, entry_ids, matrix = _apply(chunk_ids, entry_ids, matrix, changes)
+    return chunk_ids, entry_ids, matrix, index_version
+
+
+def write_base(owner_id: int, chunk_ids, entry_ids, matrix, index_version: int):
+    """
+    Make a database load taken at index_version owner_id's base shard,
+    unless the shard is already that recent. Log records of later versions
+    are kept.
+    """
+    with _locked(owner_id):
+        generation, base_version, records = _read_log(owner_id)
+        if generation and _replay(base_version, records)[0] >= index_version:
+            return
+        kept = [record for record in records if record[1] > index_version]
+        try:
+            _write_generation(owner_id, _next_generation(owner_id), index_version, chunk_ids, entry_ids, matrix, kept)
+        except OSError:
+            # e.g. a reader had the log open on Windows; the caller serves the database load
+            logger.warning("Could not rebuild vector shard for user %s", owner_id, exc_info=True)
+
+
+def append(owner_id: int, entries: dict, before: int, after: int):
+    """
+    Log that, as of index version after (bumped from before), each entry's
+    rows are the given ones (none for a delete). Without entries only the
+    version change is logged.
+
+    Args:
+        entries: {entry_id: (chunk_ids, matrix, ...)}
+    """
+    if not entries:
+        entries = {_NO_ENTRY: ([], [])}
+    data = b"".join(
+        _encode_record(before, after, entry_id, chunk_ids, matrix)
+        for entry_id, (chunk_ids, matrix, *_) in entries.items()
+    )
+
+    with _locked(owner_id):
+        path = _path(owner_id, "log")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(_log_header(0, 0))
+
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+        if os.path.getsize(path) > settings.SHARD_COMPACT_BYTES and _log_generation(owner_id):
+            try:
+                _compact(owner_id)
+            except OSError:
+                # e.g. a reader had the log open on Windows; retried on the next append
+                logger.warning("Could not compact vector shard for user %s", owner_id, exc_info=True)
+
+
+def invalidate(owner_id: int):
+    """Drop owner_id's log after a failed write, so the next load rebuilds the shard"""
+    try:
+        os.remove(_path(owner_id, "log"))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # Still detected: the lost record leaves a gap in the index versions
+        logger.warning("Could not invalidate vector shard for user %s", owner_id, exc_info=True)
+
+
+def _compact(owner_id: int):
+    """Fold the log into the next base generation. Caller holds the lock."""
+    generation, base_version, records = _read_log(owner_id)
+    chunk_ids, entry_ids, matrix = _read_base(owner_id, generation)
+    index_version, changes = _replay(base_version, records)
+    # Records past a gap stay logged; the shard reads as stale until rebuilt
+    kept = [record for record in records if record[1] > index_version]
+    _write_generation(owner_id, _next_generation(owner_id), index_version, *_apply(chunk_ids, entry_ids, matrix, changes), kept)
+
+
+def _write_generation(owner_id: int, generation: int, index_version: int, chunk_ids, entry_ids, matrix, records):
+    """Write base generation and swap in a log naming it. Caller holds the lock."""
+    _write_base(owner_id, generation, chunk_ids, entry_ids, matrix)
+
+    new_log = _path(owner_id, "log.tmp")
+    with open(new_log, "wb") as f:
+        f.write(_log_header(generation, index_version))
+        f.write(b"".join(_encode_record(*record) for record in records))
+    try:
+        os.replace(new_log, _path(owner_id, "log"))
+    except OSError:
+        os.remove(_base_path(owner_id, generation))
+        raise
+
+    for path, older in _bases(owner_id):
+        if older < generation:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still mapped by a reader on Windows; removed by a later compaction
+
+
+def _bases(owner_id: int):
+    """(path, generation) of owner_id's base shards on disk"""
+    for path in glob.glob(os.path.join(_dir(), f"{owner_id}.*.vec")):
+        generation = os.path.basename(path).split(".")[1]
+        if generation.isdigit():
+            yield path, int(generation)
+
+
+def _next_generation(owner_id: int) -> int:
+    """One past any base on disk, including ones left behind by an invalidated log"""
+    return max([_log_generation(owner_id)] + [generation for _, generation in _bases(owner_id)]) + 1
+
+
+def _base_path(owner_id: int, generation: int) -> str:
+    return _path(owner_id, f"{generation}.vec")
+
+
+def _log_header(generation: int, index_version: int) -> bytes:
+    return _LOG_HEADER.pack(_LOG_MAGIC, _FORMAT_VERSION, 0, generation, index_version)
+
+
+def _log_generation(owner_id: int) -> int:
+    """The base generation owner_id's log names; 0 without a base"""
+    try:
+        with open(_path(owner_id, "log"), "rb") as f:
+            header = f.read(_LOG_HEADER.size)
+    except FileNotFoundError:
+        return 0
+    return _parse_log_header(header)[0]
+
+
+def _parse_log_header(data: bytes):
+    """(base generation, index version), (0, 0) without a valid header"""
+    if len(data) < _LOG_HEADER.size:
+        return 0, 0
+    magic, format_version, _, generation, index_version = _LOG_HEADER.unpack_from(data)
+    if magic != _LOG_MAGIC or format_version != _FORMAT_VERSION:
+        return 0, 0
+    return generation, index_version
+
+
+def _read_base(owner_id: int, generation: int):
+    path = _base_path(owner_id, generation)
+    with open(path, "rb") as f:
+        magic, format_version, _, dim, count = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC or format_version != _FORMAT_VERSION or dim != EMBEDDING_DIM:
+        raise ValueError(f"{path} is not a version {_FORMAT_VERSION} vector shard")
+
+    if count == 0:
+        empty_ids = np.empty(0, dtype=_ID_DTYPE)
+        return empty_ids, empty_ids, np.empty((0, dim), dtype=EMBEDDING_DTYPE)
+
+    matrix = np.memmap(path, dtype=EMBEDDING_DTYPE, mode="r", offset=_HEADER_SIZE, shape=(count, dim))
+    ids_offset = _HEADER_SIZE + matrix.nbytes
+    chunk_ids = np.memmap(path, dtype=_ID_DTYPE, mode="r", offset=ids_offset, shape=(count,))
+    entry_ids = np.memmap(path, dtype=_ID_DTYPE, mode="r", offset=ids_offset + chunk_ids.nbytes, shape=(count,))
+    return chunk_ids, entry_ids, matrix
+
+
+def _write_base(owner_id: int, generation: int, chunk_ids, entry_ids, matrix):
+    chunk_ids = np.asarray(chunk_ids, dtype=_ID_DTYPE)
+    order = np.argsort(chunk_ids, kind="stable")
+    matrix = np.asarray(matrix, dtype=EMBEDDING_DTYPE).reshape(len(chunk_ids), EMBEDDING_DIM)
+
+    os.makedirs(_dir(), exist_ok=True)
+    path = _base_path(owner_id, generation)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, 0, EMBEDDING_DIM, len(chunk_ids)).ljust(_HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(matrix[order]).tobytes())
+        f.write(chunk_ids[order].tobytes())
+        f.write(np.asarray(entry_ids, dtype=_ID_DTYPE)[order].tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _encode_record(before: int, after: int, entry_id: int, chunk_ids, matrix) -> bytes:
+    chunk_ids = np.asarray(chunk_ids, dtype=_ID_DTYPE)
+    matrix = np.asarray(matrix, dtype=EMBEDDING_DTYPE).reshape(len(chunk_ids), EMBEDDING_DIM)
+    return _RECORD.pack(_RECORD_MAGIC, before, after, entry_id, len(chunk_ids)) + chunk_ids.tobytes() + matrix.tobytes()
+
+
+def _read_log(owner_id: int):
+    """
+    Returns:
+        (base generation, base index version, records), each record a
+        (before, after, entry_id, chunk_ids, matrix) tuple in log order
+    """
+    try:
+        with open(_path(owner_id, "log"), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return 0, 0, []
+
+    generation, base_version = _parse_log_header(data)
+    records, offset = [], _LOG_HEADER.size
+    row_size = EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize
+    while offset + _RECORD.size <= len(data):
+        magic, before, after, entry_id, count = _RECORD.unpack_from(data, offset)
+        end = offset + _RECORD.size + count * (_ID_DTYPE.itemsize + row_size)
+        if magic != _RECORD_MAGIC or end > len(data):
+            break  # Torn tail from a crashed writer
+        ids_end = offset + _RECORD.size + count * _ID_DTYPE.itemsize
+        records.append((
+            before, after, entry_id,
+            np.frombuffer(data, dtype=_ID_DTYPE, count=count, offset=offset + _RECORD.size),
+            np.frombuffer(data, dtype=EMBEDDING_DTYPE, count=count * EMBEDDING_DIM, offset=ids_end).reshape(count, EMBEDDING_DIM)
+        ))
+        offset = end
+    return generation, base_version, records
+
+
+def _replay(base_version: int, records: list):
+    """
+    Replay records over a base at base_version, in index version order
+    (appends of concurrent commits can reach the log out of order).
+
+    Returns:
+        (index version reached, {entry_id: (chunk_ids, matrix)}), stopping
+        at the first version no record accounts for
+    """
+    index_version, changes = base_version, {}
+    for before, after, entry_id, chunk_ids, matrix in sorted(records, key=lambda record: record[1]):
+        if after <= base_version:
+            continue  # Already in the base
+        if before > index_version:
+            break
+        index_version = max(index_version, after)
+        if entry_id != _NO_ENTRY:
+            changes[entry_id] = (chunk_ids, matrix)
+    return index_version, changes
+
+
+def _apply(chunk_ids, entry_ids, matrix, changes: dict):
+    keep = ~np.isin(entry_ids, list(changes))
+    return (
+        np.concatenate([chunk_ids[keep]] + [ids for ids, _ in changes.values()]),
+        np.concatenate([entry_ids[keep]] + [
+            np.full(len(ids), entry_id, dtype=_ID_DTYPE) for entry_id, (ids, _) in changes.items()
+        ]),
+        np.concatenate([matrix[keep]] + [rows for _, rows in changes.values()])
+    )
+
+
+@contextmanager
+def _locked(owner_id: int):
+    os.makedirs(_dir(), exist_ok=True)
+    fd = os.open(_path(owner_id, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        if fcntl is None:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
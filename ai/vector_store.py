@@ -0,0 +1,134 @@
+import json
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.diary_chunk import DiaryChunk
+from ai.embeddings import model_id
+
+# all-MiniLM-L6-v2 output size; 384 * 4 bytes = 1536 bytes per chunk
+EMBEDDING_DIM = 384
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+def encode_embedding(vector) -> bytes:
+    """Serialize an embedding to raw little-endian float32 bytes"""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    """View stored bytes as a float32 vector (read-only, no copy)"""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def rows_to_matrix(blobs) -> np.ndarray:
+    """
+    Turn binary embedding rows into an (n, EMBEDDING_DIM) float32 matrix.
+
+    The rows are joined into one contiguous buffer and viewed with
+    np.frombuffer, so there is no per-row array and no JSON decode.
+    The returned matrix is read-only.
+    """
+    if not blobs:
+        return np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE)
+    buffer = b"".join(blobs)
+    return np.frombuffer(buffer, dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
+
+
+def active_model_filter():
+    """
+    Only chunks embedded by the configured model can be compared with its
+    question embeddings. NULL embedding_model means the chunk predates the
+    column and came from LEGACY_EMBEDDING_MODEL.
+    """
+    active = model_id()
+    if active == settings.LEGACY_EMBEDDING_MODEL:
+        return or_(DiaryChunk.embedding_model == active, DiaryChunk.embedding_model.is_(None))
+    return DiaryChunk.embedding_model == active
+
+
+def load_owner_embeddings(db: Session, owner_id: int):
+    """
+    Phase one of retrieval: load only what scoring needs.
+
+    Selects (id, entry_id, embedding_vec) for the owner's chunks of the
+    active embedding model, never the chunk text. Rows that have not been backfilled yet are read from the
+    legacy JSON column in a second query so reads work mid-migration.
+
+    Returns:
+        (chunk_ids, entry_ids, matrix) with matrix rows aligned to the ids
+    """
+    rows = db.query(
+        DiaryChunk.id, DiaryChunk.entry_id, DiaryChunk.embedding_vec
+    ).filter(
+        DiaryChunk.owner_id == owner_id,
+        active_model_filter()
+    ).order_by(
+        DiaryChunk.id
+    ).all()
+
+    legacy = {}
+    if any(r.embedding_vec is None for r in rows):
+        legacy = dict(db.query(DiaryChunk.id, DiaryChunk.embedding).filter(
+            DiaryChunk.owner_id == owner_id,
+            DiaryChunk.embedding_vec.is_(None),
+            active_model_filter()
+        ).all())
+
+    matrix = rows_to_matrix([
+        r.embedding_vec if r.embedding_vec is not None else encode_embedding(json.loads(legacy[r.id]))
+        for r in rows
+    ])
+    return [r.id for r in rows], [r.entry_id for r in rows], matrix
+
+
+def load_owner_texts(db: Session, owner_id: int):
+    """Stream (id, entry_id, chunk_text) for the owner's chunks of the active model"""
+    return db.query(
+        DiaryChunk.id, DiaryChunk.entry_id, DiaryChunk.chunk_text
+    ).filter(
+        DiaryChunk.owner_id == owner_id,
+        active_model_filter()
+    ).yield_per(1000)
+
+
+def fetch_chunks(db: Session, chunk_ids) -> dict:
+    """
+    Phase two of retrieval: load text for the winning chunks only.
+
+    Returns:
+        dict of chunk id -> row with id, entry_id and chunk_text
+    """
+    if not chunk_ids:
+        return {}
+    rows = db.query(
+        DiaryChunk.id, DiaryChunk.entry_id, DiaryChunk.chunk_text
+    ).filter(
+        DiaryChunk.id.in_(chunk_ids)
+    ).all()
+    return {r.id: r for r in rows}
+
+
+def fetch_embeddings(db: Session, chunk_ids):
+    """
+    Load the stored float32 vectors of specific chunks.
+
+    Returns:
+        (chunk_ids, matrix) for the chunks that still exist, in the order
+        they were asked for
+    """
+    if not chunk_ids:
+        return [], rows_to_matrix([])
+    rows = {
+        r.id: r for r in db.query(
+            DiaryChunk.id, DiaryChunk.embedding_vec, DiaryChunk.embedding
+        ).filter(
+            DiaryChunk.id.in_(chunk_ids)
+        ).all()
+    }
+    found = [chunk_id for chunk_id in chunk_ids if chunk_id in rows]
+    return found, rows_to_matrix([
+        rows[i].embedding_vec if rows[i].embedding_vec is not None else encode_embedding(json.loads(rows[i].embedding))
+        for i in found
+    ])
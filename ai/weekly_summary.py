@@ -1,8 +1,11 @@
+import hashlib
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 
+from config import settings
 from ai.llm import get_llm
 from models.diary import DiaryEntry
+from models.weekly_summary import WeeklySummary
 
 WEEKLY_SUMMARY_PROMPT = """
 You are a quiet writing guide.
@@ -24,22 +27,88 @@ Diary entries:
 
 
 # -------- DB FETCH (repo logic) --------
-def fetch_last_week_entries(db: Session, user_id: int) -> list[str]:
+def _last_week_query(db: Session, user_id: int, *columns):
     start_date = datetime.utcnow() - timedelta(days=7)
-
-    diaries = (
-        db.query(DiaryEntry)
+    return (
+        db.query(*columns)
         .filter(DiaryEntry.owner_id == user_id)
         .filter(DiaryEntry.created_at >= start_date)
-        .order_by(DiaryEntry.created_at.asc())
-        .all()
+        .order_by(DiaryEntry.created_at.asc(), DiaryEntry.id.asc())
+    )
+
+
+def fetch_last_week_entries(db: Session, user_id: int) -> list[str]:
+    return [content for (content,) in _last_week_query(db, user_id, DiaryEntry.content)]
+
+
+def _last_week_fingerprint(db: Session, user_id: int) -> str:
+    """Changes whenever an entry in the window is added, edited or deleted"""
+    digest = hashlib.sha256()
+    for entry_id, updated_at in _last_week_query(db, user_id, DiaryEntry.id, DiaryEntry.updated_at):
+        digest.update(f"{entry_id}:{updated_at};".encode())
+    return digest.hexdigest()
+
+
+# -------- SUMMARY CACHE --------
+def _iso_week(now: datetime) -> str:
+    year, week, _ = now.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _cached_summary(db: Session, user_id: int, iso_week: str, fingerprint: str):
+    ttl_start = datetime.utcnow() - timedelta(hours=settings.WEEKLY_SUMMARY_TTL_HOURS)
+    row = (
+        db.query(WeeklySummary.summary)
+        .filter(
+            WeeklySummary.user_id == user_id,
+            WeeklySummary.iso_week == iso_week,
+            WeeklySummary.fingerprint == fingerprint,
+            WeeklySummary.generated_at >= ttl_start
+        )
+        .order_by(WeeklySummary.generated_at.desc())
+        .first()
     )
+    return row.summary if row else None
+
+
+def _store_summary(db: Session, user_id: int, iso_week: str, fingerprint: str, summary: str):
+    invalidate_weekly_summary(db, user_id)
+    db.add(WeeklySummary(
+        user_id=user_id,
+        iso_week=iso_week,
+        fingerprint=fingerprint,
+        summary=summary,
+        generated_at=datetime.utcnow()
+    ))
+    db.commit()
+
+
+def invalidate_weekly_summary(db: Session, user_id: int):
+    """Drop the user's cached summaries (in the caller's transaction)"""
+    db.query(WeeklySummary).filter(
+        WeeklySummary.user_id == user_id
+    ).delete(synchronize_session=False)
 
-    return [d.content for d in diaries]
 
 # -------- AI SERVICE --------
 def generate_weekly_summary(db: Session, user_id: int) -> str:
-    entries = fetch_last_week_entries(db, user_id)
+    """
+    Summary of the last 7 days, reused while the entries in that window
+    are unchanged (same ids and updated_at), for up to
+    WEEKLY_SUMMARY_TTL_HOURS within the same ISO week.
+    """
+    iso_week = _iso_week(datetime.utcnow())
+    fingerprint = _last_week_fingerprint(db, user_id)
+    cached = _cached_summary(db, user_id, iso_week, fingerprint)
+    if cached is not None:
+        return cached
+
+    summary = _summarize(fetch_last_week_entries(db, user_id))
+    _store_summary(db, user_id, iso_week, fingerprint, summary)
+    return summary
+
+
+def _summarize(entries: list[str]) -> str:
     llm = get_llm()
 
     # Case 1: No entries
@@ -60,9 +129,9 @@ def generate_weekly_summary(db: Session, user_id: int) -> str:
         Diary entry:
         {entries[0]}
         """
-        return llm.invoke(prompt).content
+        return llm.invoke(prompt, deadline=settings.LLM_SUMMARY_DEADLINE).content
 
     # Case 3: Two or more entries
     joined_entries = "\n\n".join(entries)
     prompt = WEEKLY_SUMMARY_PROMPT.format(entries=joined_entries)
-    return llm.invoke(prompt).content
+    return llm.invoke(prompt, deadline=settings.LLM_SUMMARY_DEADLINE).content
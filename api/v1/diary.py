@@ -3,10 +3,13 @@ from sqlalchemy.orm import Session
 from typing import List
 
 from utilities import get_db, get_current_user
-from schemas.diary import DiaryCreate, DiaryOut, DiaryUpdate
+from schemas.diary import DiaryCreate, DiaryOut, DiaryUpdate, IndexStatusOut
 from models.diary import DiaryEntry
 from models.user import User
-from ai.diary_indexing import index_diary_entry
+from ai.diary_indexing import sync_chunk_mood
+from ai.index_queue import schedule_index, index_status
+from ai.weekly_summary import invalidate_weekly_summary
+from ai.vector_cache import remove_entry_on_commit
 
 
 router = APIRouter(prefix="/diary", tags=["diary"])
@@ -20,12 +23,13 @@ def create_entry(payload: DiaryCreate, db: Session = Depends(get_db), current_us
         mood=payload.mood  # ADD THIS LINE
     )
     db.add(entry)
-    db.commit()
-    db.refresh(entry)
+    db.flush()
 
-    # diary indexing
-    index_diary_entry(db, entry, current_user.id)
+    # diary indexing (queued with the entry when INDEX_ASYNC is on)
+    schedule_index(db, entry, current_user.id)
+    invalidate_weekly_summary(db, current_user.id)
     db.commit()
+    db.refresh(entry)
 
     return entry
 
@@ -69,24 +73,42 @@ def update_entry(entry_id: int, payload: DiaryUpdate, db: Session = Depends(get_
 
     # Track if we need to re-index
     needs_reindex = False
+    mood_changed = False
 
     if payload.title is not None:
         entry.title = payload.title
     if payload.content is not None:
+        needs_reindex = payload.content != entry.content  # Re-index if content changes
         entry.content = payload.content
-        needs_reindex = True  # Re-index if content changes
     if payload.mood is not None:  # ADD THIS BLOCK
+        mood_changed = payload.mood != entry.mood
         entry.mood = payload.mood
 
     # Only re-index if content changed
+    # Chunks kept by an incremental re-index need the new mood too
+    if mood_changed:
+        sync_chunk_mood(db, entry)
     if needs_reindex:
-        index_diary_entry(db, entry, current_user.id)
+        schedule_index(db, entry, current_user.id)
+    invalidate_weekly_summary(db, current_user.id)
 
     db.add(entry)
     db.commit()
     db.refresh(entry)
     return entry
 
+@router.get("/{entry_id}/index-status", response_model=IndexStatusOut)
+def get_index_status(entry_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Whether the entry's latest content is searchable by the AI chat yet"""
+    entry = (
+        db.query(DiaryEntry.id)
+        .filter(DiaryEntry.id == entry_id, DiaryEntry.owner_id == current_user.id)
+        .first()
+    )
+    if not entry:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    return index_status(db, entry_id)
+
 @router.delete("/{entry_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_entry(entry_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     entry = (
@@ -98,5 +120,7 @@ def delete_entry(entry_id: int, db: Session = Depends(get_db), current_user: Use
         raise HTTPException(status_code=404, detail="Entry not found")
 
     db.delete(entry)
+    invalidate_weekly_summary(db, current_user.id)
+    remove_entry_on_commit(db, current_user.id, entry_id)
     db.commit()
     return None
\ No newline at end of file
@@ -1,12 +1,16 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
+import json
 import uuid
 
 from utilities import get_db, get_current_user
 from models.user import User
-from ai.diary_chat import chat_with_diary
+from ai.diary_chat import chat_with_diary, build_chat_prompt, reply_without_llm, stream_chat_reply
 from ai.weekly_summary import generate_weekly_summary
+from ai.resilience import LLMUnavailable
 
 router = APIRouter(prefix="/diary/ai", tags=["diary-ai"])
 
@@ -57,6 +61,58 @@ def chat_endpoint(
     }
 
 
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    payload: ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Same as /chat, but streams the answer as Server-Sent Events:
+
+    - `token` events carry `{"text": ...}` pieces of the answer as the LLM
+      generates them
+    - a final `done` event carries the ChatResponse fields (`error` instead
+      if the LLM failed, with a friendly answer)
+    
+    Requires Bearer token in Authorization header.
+    """
+    session_id = payload.session_id or str(uuid.uuid4())
+    user_id = current_user.id
+    
+    # Retrieval runs now, with the request's session; the stream saves the
+    # exchange with its own once the answer is complete
+    def prepare():
+        prepared = build_chat_prompt(db, user_id, session_id, payload.question)
+        if prepared.prompt is None:
+            return None, reply_without_llm(db, user_id, session_id, payload.question, prepared)
+        db.commit()  # Don't hold the history cleanup's locks for the whole stream
+        return prepared, None
+    
+    prepared, reply = await run_in_threadpool(prepare)
+    
+    async def events():
+        if prepared is None:
+            yield _sse("token", {"text": reply["answer"]})
+            yield _sse("done", {**reply, "session_id": session_id})
+            return
+        async for event, data in stream_chat_reply(prepared, user_id, session_id, payload.question):
+            if event == "token":
+                yield _sse(event, {"text": data})
+            else:
+                yield _sse(event, {**data, "session_id": session_id})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.post("/weekly-summary", response_model=WeeklySummaryResponse)
 def weekly_summary(
     db: Session = Depends(get_db),
@@ -66,7 +122,13 @@ def weekly_summary(
     Generate a weekly summary of diary entries for the authenticated user.
     Requires Bearer token in Authorization header.
     """
-    summary = generate_weekly_summary(db, current_user.id)
+    try:
+        summary = generate_weekly_summary(db, current_user.id)
+    except LLMUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The AI service is temporarily unavailable. Please try again shortly."
+        )
     return {"summary": summary}
 
 
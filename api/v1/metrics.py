@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+
+from utilities import get_current_user
+from models.user import User
+from ai.diary_chat import cache_stats
+from ai.embeddings import embedding_service
+from ai.embedding_cache import embedding_cache
+from ai.llm import resilient_llm
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("")
+def metrics(current_user: User = Depends(get_current_user)):
+    """
+    Per-process counters for the AI pipeline (embedding batches, caches,
+    LLM retries and circuit breaker), for signed-in users only.
+    Each uvicorn worker reports its own numbers.
+    """
+    return {
+        "embedding": embedding_service.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        **cache_stats(),
+        "llm": resilient_llm.stats(),
+    }
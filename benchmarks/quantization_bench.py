@@ -0,0 +1,71 @@
+"""
+Recall and memory impact of int8 vectors (ai/quantization.py).
+
+Builds a synthetic diary corpus (chunks drawn around a few hundred
+"topics" so near neighbours are close, like a real diary), then compares
+exact float32 top-k against the int8 first pass alone and against the
+int8 first pass followed by exact rescoring of RESCORE_CANDIDATES.
+
+Usage:
+    python -m benchmarks.quantization_bench
+"""
+import time
+
+import numpy as np
+
+from ai.quantization import QuantizedMatrix
+from ai.retrieval import normalize_rows, top_k
+from ai.vector_store import EMBEDDING_DIM
+
+SIZES = (10_000, 100_000)
+QUERIES = 200
+K = 8
+RESCORE_CANDIDATES = 32
+TOPICS = 300
+SPREAD = 0.8
+
+
+def _corpus(rng, topics, n):
+    return normalize_rows(topics[rng.integers(0, len(topics), n)] + SPREAD * rng.standard_normal((n, EMBEDDING_DIM)))
+
+
+def _recall(expected, got):
+    return np.mean([len(set(e) & set(g)) / K for e, g in zip(expected, got)])
+
+
+def main():
+    rng = np.random.default_rng(2)
+    topics = rng.standard_normal((TOPICS, EMBEDDING_DIM))
+    print(f"{'chunks':>8} {'f32 MB':>7} {'int8 MB':>8} {'f32 ms':>7} {'int8 ms':>8} {'recall':>7} {'rescored':>9}")
+
+    for n in SIZES:
+        matrix = _corpus(rng, topics, n)
+        queries = _corpus(rng, topics, QUERIES)
+        quantized = QuantizedMatrix.quantize(matrix)
+
+        exact = [top_k(matrix, q, K)[0] for q in queries]
+        first_pass = [top_k(quantized, q, K)[0] for q in queries]
+
+        rescored = []
+        for q in queries:
+            candidates, _ = top_k(quantized, q, RESCORE_CANDIDATES)
+            rows, _ = top_k(matrix[candidates], q, K)
+            rescored.append(candidates[rows])
+
+        start = time.perf_counter()
+        for q in queries:
+            matrix @ q
+        f32_ms = (time.perf_counter() - start) / QUERIES * 1000
+        start = time.perf_counter()
+        for q in queries:
+            quantized @ q
+        int8_ms = (time.perf_counter() - start) / QUERIES * 1000
+
+        print(
+            f"{n:>8} {matrix.nbytes / 2**20:>7.1f} {quantized.nbytes / 2**20:>8.1f} "
+            f"{f32_ms:>7.2f} {int8_ms:>8.2f} {_recall(exact, first_pass):>7.3f} {_recall(exact, rescored):>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark for the chat retrieval step.
+
+Compares the old path (cosine_similarity on raw vectors, zip with rows,
+filter by threshold, full sort) with ai.retrieval.top_k on pre-normalized
+vectors, then brute force with the IVF index (ai/ivf.py) on a clustered
+corpus, reporting recall@k of the approximate search.
+
+Usage:
+    python -m benchmarks.retrieval_bench
+"""
+import time
+
+import numpy as np
+
+from ai.retrieval import normalize_rows, top_k, search
+from ai.ivf import IVFIndex
+from ai.vector_cache import UserVectors
+from ai.vector_store import EMBEDDING_DIM
+
+try:
+    from sklearn.metrics.pairwise import cosine_similarity
+except ImportError:  # Same math as sklearn, without the dependency
+    def cosine_similarity(a, b):
+        return normalize_rows(np.asarray(a)) @ normalize_rows(np.asarray(b)).T
+
+SIZES = (1_000, 10_000, 100_000)
+K = 8
+THRESHOLD = 0.30
+REPEATS = 20
+IVF_SIZES = (20_000, 100_000)
+IVF_NPROBE = 8
+TOPICS = 300
+
+
+def _old_path(rows, vectors, question):
+    scores = cosine_similarity([question], vectors)[0]
+    relevant = [(row, score) for row, score in zip(rows, scores) if score >= THRESHOLD]
+    relevant.sort(key=lambda x: x[1], reverse=True)
+    return relevant[:K]
+
+
+def _new_path(matrix, question):
+    return top_k(matrix, question, k=K, threshold=THRESHOLD)
+
+
+def _timeit(fn, *args):
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+
+    for n in SIZES:
+        # Correlated vectors so a realistic share clears the threshold
+        base = rng.standard_normal(EMBEDDING_DIM)
+        vectors = (rng.standard_normal((n, EMBEDDING_DIM)) + base).astype(np.float32)
+        question = (rng.standard_normal(EMBEDDING_DIM) + base).astype(np.float32)
+        rows = list(range(n))
+        matrix = normalize_rows(vectors)
+
+        old_top = [row for row, _ in _old_path(rows, vectors, question)]
+        new_top, _ = _new_path(matrix, question)
+        assert old_top == new_top.tolist(), "kernels disagree"
+
+        old_ms = _timeit(_old_path, rows, vectors, question)
+        new_ms = _timeit(_new_path, matrix, question)
+        print(f"{n:>8} {old_ms:>10.2f} {new_ms:>10.2f} {old_ms / new_ms:>7.1f}x")
+
+
+def ivf_main():
+    rng = np.random.default_rng(1)
+    topics = rng.standard_normal((TOPICS, EMBEDDING_DIM))
+    print(f"\n{'chunks':>8} {'build s':>8} {'exact ms':>9} {'ivf ms':>8} {'recall':>7}")
+
+    for n in IVF_SIZES:
+        matrix = normalize_rows(topics[rng.integers(0, TOPICS, n)] + 0.8 * rng.standard_normal((n, EMBEDDING_DIM)))
+        queries = normalize_rows(topics[rng.integers(0, TOPICS, REPEATS)] + 0.8 * rng.standard_normal((REPEATS, EMBEDDING_DIM)))
+        chunk_ids = np.arange(n)
+
+        start = time.perf_counter()
+        vectors = UserVectors(matrix, chunk_ids, chunk_ids, ivf=IVFIndex.build(matrix, chunk_ids))
+        build_s = time.perf_counter() - start
+
+        exact = [top_k(matrix, q, K)[0] for q in queries]
+        approx = [search(vectors, q, K, nprobe=IVF_NPROBE)[0] for q in queries]
+        recall = np.mean([len(set(e) & set(a)) / K for e, a in zip(exact, approx)])
+
+        exact_ms = _timeit(lambda: [top_k(matrix, q, K) for q in queries]) / REPEATS
+        ivf_ms = _timeit(lambda: [search(vectors, q, K, nprobe=IVF_NPROBE) for q in queries]) / REPEATS
+        print(f"{n:>8} {build_s:>8.2f} {exact_ms:>9.2f} {ivf_ms:>8.2f} {recall:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
+    ivf_main()
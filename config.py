@@ -13,4 +13,84 @@ class Settings:
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60 * 24))
     DATABASE_URL: str = os.getenv("DATABASE_URL")  # Must be set in .env
 
+    # Chat completions for diary chat and weekly summaries (ai/llm.py)
+    HF_API_TOKEN: str = os.getenv("HF_API_TOKEN")
+    LLM_BASE_URL: str = os.getenv("LLM_BASE_URL", "https://router.huggingface.co/v1")
+    LLM_MODEL: str = os.getenv("LLM_MODEL", "meta-llama/Meta-Llama-3.1-8B-Instruct")
+    LLM_MAX_NEW_TOKENS: int = int(os.getenv("LLM_MAX_NEW_TOKENS", 400))
+    LLM_TEMPERATURE: float = float(os.getenv("LLM_TEMPERATURE", 0.3))
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", 120))  # Seconds per read; the full completion can take a while
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+    LLM_MAX_KEEPALIVE: int = int(os.getenv("LLM_MAX_KEEPALIVE", 10))
+    # Retries, deadlines and circuit breaking around LLM calls (ai/resilience.py)
+    LLM_MAX_ATTEMPTS: int = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+    LLM_BACKOFF_BASE: float = float(os.getenv("LLM_BACKOFF_BASE", 0.5))  # Seconds; doubles per retry, with full jitter
+    LLM_BACKOFF_MAX: float = float(os.getenv("LLM_BACKOFF_MAX", 8))
+    # Seconds for a whole answer, retries included; by default no shorter than LLM_TIMEOUT alone
+    LLM_CHAT_DEADLINE: float = float(os.getenv("LLM_CHAT_DEADLINE", LLM_TIMEOUT))
+    LLM_SUMMARY_DEADLINE: float = float(os.getenv("LLM_SUMMARY_DEADLINE", LLM_TIMEOUT))
+    LLM_BREAKER_FAILURES: int = int(os.getenv("LLM_BREAKER_FAILURES", 5))  # Consecutive failures that open the circuit; 0 disables
+    LLM_BREAKER_RESET_SECONDS: float = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+    LLM_HEDGE_PERCENTILE: float = float(os.getenv("LLM_HEDGE_PERCENTILE", 0))  # e.g. 95 to hedge slow calls; 0 disables
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+
+    # Cached /diary/ai/weekly-summary results (ai/weekly_summary.py)
+    WEEKLY_SUMMARY_TTL_HOURS: float = float(os.getenv("WEEKLY_SUMMARY_TTL_HOURS", 24))
+
+    # Sentence embedding model (ai/embeddings.py)
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    EMBEDDING_SPACE: str = os.getenv("EMBEDDING_SPACE", "")  # Stored vectors' version; empty means EMBEDDING_MODEL
+    LEGACY_EMBEDDING_MODEL: str = os.getenv("LEGACY_EMBEDDING_MODEL", "all-MiniLM-L6-v2")  # Produced chunks with no embedding_model
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")  # or "onnx"
+    ONNX_MODEL_PATH: str = os.getenv("ONNX_MODEL_PATH", "onnx/all-MiniLM-L6-v2/model_int8.onnx")
+    ONNX_THREADS: int = int(os.getenv("ONNX_THREADS", 0))  # 0 lets onnxruntime decide
+    EMBEDDING_BATCH_WINDOW_MS: float = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 5))  # 0 disables micro-batching
+    EMBEDDING_MAX_BATCH: int = int(os.getenv("EMBEDDING_MAX_BATCH", 64))
+    EMBEDDING_POOL_SIZE: int = int(os.getenv("EMBEDDING_POOL_SIZE", 0))  # Worker processes per API process; 0 runs in-process
+    EMBEDDING_POOL_MAX_PENDING: int = int(os.getenv("EMBEDDING_POOL_MAX_PENDING", 32))  # Embedding requests queued per API process before callers wait, then time out
+    EMBEDDING_POOL_THREADS: int = int(os.getenv("EMBEDDING_POOL_THREADS", 1))  # Inference threads per worker
+    EMBEDDING_WARMUP: bool = os.getenv("EMBEDDING_WARMUP", "false").lower() == "true"  # Load at startup
+
+    # Content-addressed embeddings of chunk texts (ai/embedding_cache.py)
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))  # In-memory entries per process
+    EMBEDDING_CACHE_PERSIST: bool = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true"  # embedding_cache table
+
+    # Background indexing of diary writes (ai/index_queue.py)
+    INDEX_ASYNC: bool = os.getenv("INDEX_ASYNC", "true").lower() == "true"  # False indexes inside the request
+    INDEX_WORKER_IN_PROCESS: bool = os.getenv("INDEX_WORKER_IN_PROCESS", "true").lower() == "true"  # False: run python -m ai.index_queue
+    INDEX_POLL_SECONDS: float = float(os.getenv("INDEX_POLL_SECONDS", 2))
+    INDEX_MAX_ATTEMPTS: int = int(os.getenv("INDEX_MAX_ATTEMPTS", 5))
+    INDEX_JOB_LEASE_SECONDS: int = int(os.getenv("INDEX_JOB_LEASE_SECONDS", 300))
+
+    # Per-process cache of users' embedding matrices (ai/vector_cache.py)
+    VECTOR_CACHE_MAX_MB: int = int(os.getenv("VECTOR_CACHE_MAX_MB", 256))
+    VECTOR_QUANTIZATION: str = os.getenv("VECTOR_QUANTIZATION", "none")  # "none" or "int8"
+    RESCORE_CANDIDATES: int = int(os.getenv("RESCORE_CANDIDATES", 32))  # Exact rescoring pool for int8
+
+    # BM25 over chunk text fused with vector scores (ai/lexical.py)
+    # Off by default: the index needs every chunk's text on a cache fill
+    HYBRID_RETRIEVAL: bool = os.getenv("HYBRID_RETRIEVAL", "false").lower() == "true"
+    LEXICAL_CANDIDATES: int = int(os.getenv("LEXICAL_CANDIDATES", 2000))
+    LEXICAL_PREFILTER_MIN_CHUNKS: int = int(os.getenv("LEXICAL_PREFILTER_MIN_CHUNKS", 20000))
+    # Lexical hits below RELEVANCE_THRESHOLD still qualify if they match a term this rare (~1 in 12 chunks)
+    LEXICAL_MIN_IDF: float = float(os.getenv("LEXICAL_MIN_IDF", 2.5))
+
+    # Embeddings of recent chat questions, keyed by normalized text
+    QUESTION_EMBEDDING_CACHE_SIZE: int = int(os.getenv("QUESTION_EMBEDDING_CACHE_SIZE", 4096))
+
+    # Per-user answers reused for similar questions until the diary changes (ai/answer_cache.py)
+    ANSWER_CACHE_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.92))  # Cosine similarity of the questions
+    ANSWER_CACHE_PER_USER: int = int(os.getenv("ANSWER_CACHE_PER_USER", 32))  # 0 disables the cache
+    ANSWER_CACHE_MAX_USERS: int = int(os.getenv("ANSWER_CACHE_MAX_USERS", 10000))
+    ANSWER_CACHE_TTL_SECONDS: float = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+
+    # Memory-mapped per-user vector files shared by all workers (ai/vector_shards.py)
+    VECTOR_SHARD_DIR: str = os.getenv("VECTOR_SHARD_DIR", "")  # Empty disables shards
+    SHARD_COMPACT_BYTES: int = int(os.getenv("SHARD_COMPACT_BYTES", 1024 * 1024))
+
+    # Approximate search (ai/ivf.py) for users with many chunks
+    IVF_MIN_CHUNKS: int = int(os.getenv("IVF_MIN_CHUNKS", 20000))
+    IVF_NPROBE: int = int(os.getenv("IVF_NPROBE", 8))
+
 settings = Settings()
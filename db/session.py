@@ -4,7 +4,9 @@ from config import settings
 
 engine = create_engine(
     settings.DATABASE_URL,
-    pool_pre_ping=True
+    pool_pre_ping=True,
+    # Send executemany batches (e.g. the embedding backfill) in one round trip
+    **({"fast_executemany": True} if settings.DATABASE_URL.startswith("mssql+pyodbc") else {})
 )
 
 SessionLocal = sessionmaker(
@@ -1,15 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from api.v1.api import api_router
 from db import base
 from db.session import engine
 from fastapi.middleware.cors import CORSMiddleware
+from config import settings
+from ai.embeddings import embedding_service
+from ai.index_queue import background_indexer
+from ai.llm import llm_client, resilient_llm
 
 
 # create tables (use Alembic in prod)
 base.Base.metadata.create_all(bind=engine)
 
 
-app = FastAPI(title="Diary App")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the embedding model before taking traffic (off by default so
+    # workers that only serve auth/CRUD never import it)
+    if settings.EMBEDDING_WARMUP:
+        await run_in_threadpool(embedding_service.warmup)
+    if settings.INDEX_ASYNC and settings.INDEX_WORKER_IN_PROCESS:
+        background_indexer.start()
+    yield
+    await run_in_threadpool(background_indexer.stop)
+    await run_in_threadpool(embedding_service.shutdown)
+    resilient_llm.shutdown()
+    await llm_client.aclose()
+
+
+app = FastAPI(title="Diary App", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -1,15 +1,25 @@
-from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, DateTime, ForeignKey, Index, func
 from db.base import Base
 
 class DiaryChunk(Base):
     __tablename__ = "diary_chunks"
+    __table_args__ = (
+        Index("ix_diary_chunks_owner_created", "owner_id", "entry_created_at"),
+    )
 
     id = Column(Integer, primary_key=True)
     entry_id = Column(Integer, ForeignKey("diary_entries.id", ondelete="CASCADE"))
     owner_id = Column(Integer, index=True)
 
     chunk_text = Column(Text, nullable=False)
-    embedding = Column(Text, nullable=False)  # JSON string
+    embedding = Column(Text, nullable=True)  # Legacy JSON string, see ai/backfill_embeddings.py
+    embedding_vec = Column(LargeBinary, nullable=True)  # Raw little-endian float32
+    embedding_model = Column(String(200), nullable=True)  # ai.embeddings.model_id(); NULL: LEGACY_EMBEDDING_MODEL
     chunk_index = Column(Integer)
+    content_hash = Column(String(64), nullable=True)  # sha256 of chunk_text, for incremental reindexing
+
+    # Copied from the entry so retrieval can filter by date and mood without a join
+    entry_created_at = Column(DateTime(timezone=True), nullable=True)
+    mood = Column(String(50), nullable=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, LargeBinary, DateTime, func
+from db.base import Base
+
+
+class CachedEmbedding(Base):
+    """Embedding of a normalized text, shared by every entry and user (ai/embedding_cache.py)"""
+    __tablename__ = "embedding_cache"
+
+    model_id = Column(String(200), primary_key=True)
+    text_hash = Column(String(64), primary_key=True)  # sha256 of the normalized text
+    embedding_vec = Column(LargeBinary, nullable=False)  # Raw little-endian float32
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
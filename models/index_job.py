@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, func
+from db.base import Base
+
+
+class IndexJob(Base):
+    """Pending (re)indexing of one diary entry, see ai/index_queue.py"""
+    __tablename__ = "index_jobs"
+    __table_args__ = (
+        Index("ix_index_jobs_status_available", "status", "available_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # One job per entry: re-saving an entry re-arms its existing job
+    entry_id = Column(Integer, ForeignKey("diary_entries.id", ondelete="CASCADE"), nullable=False, unique=True)
+    owner_id = Column(Integer, nullable=False, index=True)
+
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, done, failed
+    version = Column(Integer, nullable=False, default=1)  # Bumped on every enqueue
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+
+    # pending: earliest retry time; running: when the worker's lease expires
+    available_at = Column(DateTime, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
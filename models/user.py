@@ -10,4 +10,5 @@ class User(Base):
     username = Column(String(50), unique=True, index=True, nullable=False)  # NEW
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    index_version = Column(Integer, nullable=False, server_default="0")  # Bumped with every change to the user's chunks, see ai/vector_cache.py
\ No newline at end of file
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from db.base import Base
+
+
+class WeeklySummary(Base):
+    """Cached weekly summary, see ai/weekly_summary.py"""
+    __tablename__ = "weekly_summaries"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    iso_week = Column(String(10), nullable=False)  # e.g. "2025-W07"
+    fingerprint = Column(String(64), nullable=False)  # sha256 of the window's entry ids and updated_at values
+    summary = Column(Text, nullable=False)
+
+    generated_at = Column(DateTime, nullable=False)  # UTC, for WEEKLY_SUMMARY_TTL_HOURS
@@ -23,4 +23,10 @@ class DiaryOut(DiaryBase):
     updated_at: datetime
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class IndexStatusOut(BaseModel):
+    status: str  # pending, running, done or failed
+    attempts: int
+    last_error: Optional[str] = None
+    updated_at: Optional[datetime] = None